@@ -2,10 +2,10 @@
 CampBot, Python bot framework for camptocamp.org
 
 Usage:
-  campbot clean_rc <days> <lang> <thread_url> [--login=<login>] [--password=<password>] [--delay=<seconds>] [--batch]
+  campbot clean_rc <days> <lang> <thread_url> [--login=<login>] [--password=<password>] [--delay=<seconds>] [--batch] [--stats=<filename>]
   campbot report_rc <days> <lang> <thread_url> [--login=<login>] [--password=<password>] [--delay=<seconds>]
-  campbot clean <url_or_file> <lang> <thread_url> [--login=<login>] [--password=<password>] [--delay=<seconds>] [--batch] [--bbcode]
-  campbot report <url_or_file> <lang> [--login=<login>] [--password=<password>] [--delay=<seconds>]
+  campbot clean <url_or_file> <lang> <thread_url> [--login=<login>] [--password=<password>] [--delay=<seconds>] [--batch] [--bbcode] [--stats=<filename>] [--dump=<filename>]
+  campbot report <url_or_file> <lang> [--login=<login>] [--password=<password>] [--delay=<seconds>] [--dump=<filename>] [--processes=<n>]
   campbot contribs [--out=<filename>] [--starts=<start_date>] [--ends=<end_date>] [--delay=<seconds>]
   campbot export <url> [--out=<filename>] [--delay=<seconds>]
 
@@ -18,6 +18,11 @@ Options:
   --delay=<seconds>         Minimum delay between each request. Default : 3 seconds
   --bbcode                  Clean old BBCode in markdown
   --out=<filename>          Output file name. Default value will depend on process
+  --stats=<filename>        Dump processors statistics (CPU time, scanned and changed fields) in a JSON file
+  --dump=<filename>         Read documents in a dump (SQLite file) instead of camptocamp.org API.
+                            Modifications are still saved on camptocamp.org. Dump is opened
+                            read-only, as a snapshot : see Dump.publish_snapshot()
+  --processes=<n>           Number of processes used to test documents
 
 
 Commands:
@@ -68,6 +73,17 @@ def get_campbot(args):
 
     bot = CampBot(proxies=proxies, min_delay=args["--delay"])
 
+    if args["--dump"]:
+        from campbot.dump import Dump, DumpWikiBot
+
+        bot.wiki = DumpWikiBot(
+            bot,
+            bot.wiki.api_url,
+            Dump(args["--dump"], snapshot=True),
+            proxies=proxies,
+            min_delay=args["--delay"],
+        )
+
     if args["--login"] and args["--password"]:
         bot.login(login=args["--login"], password=args["--password"])
 
@@ -95,12 +111,14 @@ def main(args):
             lang=args["<lang>"],
             ask_before_saving=not args["--batch"],
             thread_url=args["<thread_url>"],
+            stats_filename=args["--stats"],
         )
 
     elif args["report"]:
         get_campbot(args).report(
             args["<url_or_file>"],
             lang=args["<lang>"],
+            processes=int(args["--processes"]) if args["--processes"] else None,
         )
 
     elif args["clean"]:
@@ -110,6 +128,7 @@ def main(args):
             ask_before_saving=not args["--batch"],
             thread_url=args["<thread_url>"],
             clean_bbcode=args["--bbcode"],
+            stats_filename=args["--stats"],
         )
 
     elif args["contribs"]:
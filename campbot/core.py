@@ -4,13 +4,16 @@ from __future__ import print_function, unicode_literals, division
 
 import os
 import io
+import json
 import requests
 from datetime import datetime, timedelta
 from dateutil import parser
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 import pytz
 import logging
 import time
+import threading
 from . import utils
 from . import objects
 from campbot.processors import get_automatic_replacments
@@ -40,6 +43,7 @@ class BaseBot(object):
         self._session = requests.Session()
         self.proxies = proxies
         self._next_request_datetime = datetime.now()
+        self._wait_lock = threading.Lock()
         if min_delay is not None:
             self.min_delay = timedelta(seconds=float(min_delay))
 
@@ -48,13 +52,18 @@ class BaseBot(object):
         return self._session.headers
 
     def _wait(self):
-        to_wait = (self._next_request_datetime - datetime.now()).total_seconds()
+        # book a time slot, and wait for it outside of the lock : requests
+        # sent from several threads are still spaced by min_delay
+        with self._wait_lock:
+            now = datetime.now()
+            slot = max(now, self._next_request_datetime)
+            self._next_request_datetime = slot + self.min_delay
+
+        to_wait = (slot - now).total_seconds()
 
         if to_wait > 0:
             time.sleep(to_wait)
 
-        self._next_request_datetime = datetime.now() + self.min_delay
-
     def get(self, url, **kwargs):
         key = (url, str(kwargs))
 
@@ -524,7 +533,13 @@ class CampBot(object):
         return self.wiki.get_documents(filters, constructor=constructor)
 
     def clean(
-        self, url_or_filename, lang, ask_before_saving, thread_url, clean_bbcode=False
+        self,
+        url_or_filename,
+        lang,
+        ask_before_saving,
+        thread_url,
+        clean_bbcode=False,
+        stats_filename=None,
     ):
         """
         Clean a set of document.
@@ -533,6 +548,7 @@ class CampBot(object):
         :param lang: lang identifier
         :param ask_before_saving: Boolean
         :param clean_bbcode: Boolean
+        :param stats_filename: if set, processors statistics are dumped in this JSON file
 
         """
 
@@ -540,30 +556,42 @@ class CampBot(object):
         report_header = f"Clean documents from `{url_or_filename}`"
 
         self._process_documents(
-            documents, lang, ask_before_saving, report_header, thread_url, clean_bbcode
+            documents,
+            lang,
+            ask_before_saving,
+            report_header,
+            thread_url,
+            clean_bbcode,
+            stats_filename,
         )
 
-    def report(self, url_or_filename, lang):
+    def report(self, url_or_filename, lang, processes=None):
         """
         Make quality report on a set of document.
 
         :param url_or_filename: Camptocamp.org URL, or filename
         :param langs: comma-separated list of lang identifiers
+        :param processes: if greater than 1, documents are tested by this
+            number of processes
         """
 
-        documents = [d for d in self.get_documents(url_or_filename)]
+        # document id is not available on redirections...
+        documents = objects.DocumentStore(
+            self,
+            (d for d in self.get_documents(url_or_filename) if "redirects_to" not in d),
+        )
 
         tests = get_document_tests(lang)
         forum_report = []
         stdout_report = []
 
-        for test in tests:
-            failing_docs = []
-            for document in documents:
-                if "redirects_to" in document:
-                    pass  # document id is not available...
-                elif not test.test_document(document):
-                    failing_docs.append(document)
+        if processes and processes > 1:
+            failures = _test_documents_in_processes(documents, lang, processes)
+        else:
+            failures = _test_documents(lang, documents, tests)
+
+        for test, failing_indexes in zip(tests, failures):
+            failing_docs = [documents[i] for i in failing_indexes]
 
             if len(failing_docs) != 0:
                 stdout_report.append(test.name)
@@ -588,6 +616,7 @@ class CampBot(object):
         report_header,
         thread_url,
         clean_bbcode=False,
+        stats_filename=None,
     ):
 
         excluded_document_ids = [
@@ -636,7 +665,8 @@ class CampBot(object):
                             messages.append(processor.comment)
                             must_save = True
 
-                if must_save:
+                # processors may have restored original values
+                if must_save and document.is_modified():
                     comment = ", ".join(messages)
                     try:
                         new_document = document.save(
@@ -654,7 +684,26 @@ class CampBot(object):
         log_report = "\n".join(
             [f"* `{bucket}`: {count}" for bucket, count in report.items()]
         )
-        self.forum.post_message(f"### {report_header}\n\n{log_report}", thread_url)
+        stats_report = _get_processors_stats_report(processors)
+        self.forum.post_message(
+            f"### {report_header}\n\n{log_report}\n\n{stats_report}", thread_url
+        )
+
+        if stats_filename:
+            with io.open(stats_filename, "w", encoding="utf-8") as f:
+                json.dump(
+                    [
+                        dict(
+                            name=processor.__class__.__name__,
+                            comment=processor.comment,
+                            lang=processor.lang,
+                            **processor.stats.as_dict(),
+                        )
+                        for processor in processors
+                    ],
+                    f,
+                    indent=2,
+                )
 
         return report
 
@@ -776,7 +825,9 @@ class CampBot(object):
 
         return result
 
-    def clean_recent_changes(self, days, lang, ask_before_saving, thread_url):
+    def clean_recent_changes(
+        self, days, lang, ask_before_saving, thread_url, stats_filename=None
+    ):
         newest_date = utils.today().replace(hour=0, minute=0, second=0, microsecond=0)
         oldest_date = newest_date - timedelta(days=days)
 
@@ -798,14 +849,30 @@ class CampBot(object):
                 yield document
 
         self._process_documents(
-            get_documents(), lang, ask_before_saving, report_header, thread_url
+            get_documents(),
+            lang,
+            ask_before_saving,
+            report_header,
+            thread_url,
+            stats_filename=stats_filename,
         )
 
-    def get_new_contributors(self, contrib_threshold=20, outings_threshold=15):
-        with open("contributors.txt", "r") as f:
-            contributors = [
-                map(int, line.replace("\n", "").split("|")) for line in f.readlines()
-            ]
+    def get_new_contributors(
+        self, contrib_threshold=20, outings_threshold=15, dump=None
+    ):
+        """
+        :param dump: a campbot.dump.Dump object. If given, contributions are
+            counted in it, otherwise they are read in contributors.txt
+        """
+
+        if dump is not None:
+            contributors = dump.get_contributor_counts()
+        else:
+            with open("contributors.txt", "r") as f:
+                contributors = [
+                    map(int, line.replace("\n", "").split("|"))
+                    for line in f.readlines()
+                ]
 
         still_members = {
             d["username"] for d in self.forum.get_group_members("Contributeurs")
@@ -973,13 +1040,21 @@ class CampBot(object):
 
         print("</table>")
 
-    def get_users_from_route(self, route_id):
+    def get_users_from_route(self, route_id, dump=None):
         """
         Get list of user that have done a given route.
 
         :param route_id: route numrical identifier
+        :param dump: a campbot.dump.Dump object. If given, users are found
+            in its association table, with one query
         """
 
+        if dump is not None:
+            return [
+                dump.get_document(user_id) or {"document_id": user_id, "type": "u"}
+                for user_id in dump.get_users_from_route(route_id)
+            ]
+
         result = {}
         for outing in self.wiki.get_outings({"r": route_id}):
             for user in outing.associations["users"]:
@@ -988,46 +1063,188 @@ class CampBot(object):
         return list(result.values())
 
     def find_closest_documents(
-        self, constructor, longitude, latitude, buffer, filters=None
+        self,
+        constructor,
+        longitude,
+        latitude,
+        buffer,
+        filters=None,
+        dump=None,
+        limit=None,
     ):
-        fake_object = {
-            "geometry": {
-                "geom": "{"
-                + '"type":"Point", "coordinates": [{}, {}]'.format(longitude, latitude)
-                + "}"
-            }
-        }
-
-        filters = filters or {}
-        filters["bbox"] = ",".join(
-            map(
-                str,
-                [
-                    longitude - buffer,
-                    latitude - buffer,
-                    longitude + buffer,
-                    latitude + buffer,
-                ],
-            )
-        )
+        """
+        Get documents around a point, closest first. Documents are ranked
+        with API list results, only the `limit` closest ones are then
+        downloaded.
+
+        :param constructor: objects.Waypoint, objects.Route...
+        :param longitude: EPSG:3857 value
+        :param latitude: EPSG:3857 value
+        :param buffer: search distance, in EPSG:3857 units
+        :param filters: API filters, not supported with a dump
+        :param dump: a campbot.dump.Dump object. If given, documents are
+            found in it, rather than with camptocamp.org API
+        :param limit: maximum number of results, default is no limit
+
+        :return: list of {"document": ..., "distance": ...}
+        """
 
-        result = []
+        if dump is not None:
+            if filters:
+                raise NotImplementedError("Filters can't be used with a dump")
 
-        for document in self.wiki.get_documents(
-            constructor=constructor, filters=filters
-        ):
-            result.append(
+            # dump ranks them with the same filter and distances
+            result = [
                 {
-                    "document": document,
-                    "distance": utils.compute_distance(fake_object, document),
+                    "document": {"document_id": document_id, "type": typ},
+                    "distance": distance,
                 }
+                for document_id, typ, distance, _ in dump.nearest(
+                    longitude,
+                    latitude,
+                    buffer,
+                    document_type=objects.get_document_type(constructor),
+                )
+            ]
+
+        else:
+            filters = filters or {}
+            filters["bbox"] = ",".join(
+                map(
+                    str,
+                    [
+                        longitude - buffer,
+                        latitude - buffer,
+                        longitude + buffer,
+                        latitude + buffer,
+                    ],
+                )
+            )
+
+            # list results contains geometry, no need of full documents yet
+            documents = list(self.wiki.get_documents_raw(constructor.url_path, filters))
+            distances = utils.compute_distances(
+                (longitude, latitude),
+                [utils.get_coordinates(document) for document in documents],
+            )
+
+            result = [
+                {"document": document, "distance": distance}
+                for document, distance in zip(documents, distances)
+            ]
+
+            # documents without point geometry (areas, maps) are the last ones
+            result.sort(
+                key=lambda item: (item["distance"] is None, item["distance"] or 0)
             )
 
-        result.sort(key=lambda item: item["distance"])
+        result = result[:limit]
+
+        for item in result:
+            document_id = item["document"]["document_id"]
+
+            if dump is None:
+                item["document"] = self.wiki.get_wiki_object(
+                    document_id, constructor=constructor
+                )
+            else:
+                item["document"] = constructor(self, dump.get_document(document_id))
 
         return result
 
 
+def _test_documents(lang, documents, tests):
+    """
+    Documents are iterated once, a DocumentStore builds them on each access.
+
+    :return: for each test, indexes of failing documents
+    """
+
+    failures = [[] for _ in tests]
+
+    for i, document in enumerate(documents):
+        for test, failing_indexes in zip(tests, failures):
+            if not test.test_document(document):
+                failing_indexes.append(i)
+
+    return failures
+
+
+def _test_documents_in_processes(documents, lang, processes):
+    """
+    Run document tests in a pool of processes. Documents are split in shards,
+    and sent to processes as raw data : wiki objects holds the bot.
+
+    :param documents: DocumentStore
+
+    :return: for each test, indexes of failing documents, in documents order
+    """
+
+    shard_size = max(1, min(1000, -(-len(documents) // (processes * 4))))
+
+    def get_shard(start):
+        end = min(start + shard_size, len(documents))
+        return [documents.get_data(i) for i in range(start, end)]
+
+    failures = [[] for _ in get_document_tests(lang)]
+
+    # shards are unpacked on demand, with a bounded number of shards waiting
+    # for a process : the whole store is never unpacked at once
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for start in range(0, len(documents), shard_size):
+            pending.append(
+                (start, executor.submit(_test_raw_documents, lang, get_shard(start)))
+            )
+
+            if len(pending) >= processes * 2:
+                _collect_shard_failures(failures, *pending.popleft())
+
+        while pending:
+            _collect_shard_failures(failures, *pending.popleft())
+
+    return failures
+
+
+def _collect_shard_failures(failures, offset, future):
+    for test_failures, failing_indexes in zip(failures, future.result()):
+        test_failures.extend(offset + i for i in failing_indexes)
+
+
+def _test_raw_documents(lang, raw_documents):
+    """
+    Worker of _test_documents_in_processes()
+    """
+
+    documents = [
+        objects.get_constructor(data["type"])(None, data) for data in raw_documents
+    ]
+
+    return _test_documents(lang, documents, get_document_tests(lang))
+
+
+def _get_processors_stats_report(processors):
+    lines = [
+        "| Processor | CPU time (ms) | Scanned fields | Changed fields | Average size |",
+        "|---|---|---|---|---|",
+    ]
+
+    for processor in processors:
+        stats = processor.stats
+        lines.append(
+            "| {} | {:.1f} | {} | {} | {:.0f} |".format(
+                processor.comment,
+                stats.cpu_time * 1000,
+                stats.scanned_fields,
+                stats.changed_fields,
+                stats.get_average_text_size(),
+            )
+        )
+
+    return "\n".join(lines)
+
+
 def _parse_filter(url):
     url = url.replace("https://www.camptocamp.org/", "")
 
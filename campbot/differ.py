@@ -2,8 +2,14 @@ import difflib
 
 
 def get_diff_report(old, new):
-    old = flatten(old)
-    new = flatten(new)
+    return get_flat_diff_report(flatten(old), flatten(new))
+
+
+def get_flat_diff_report(old, new):
+    """
+    :param old: flattened data, see flatten()
+    :param new: flattened data
+    """
 
     keys = set(list(old.keys()) + list(new.keys()))
     result = []
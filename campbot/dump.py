@@ -2,15 +2,34 @@
 
 from __future__ import print_function
 
+import json
+import os
 import sqlite3
 import re
+import shutil
+import zlib
 
-from campbot import CampBot
+try:
+    from re import _parser as sre_parse, _constants as sre_constants  # py >= 3.11
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from campbot import CampBot, objects, utils
+from campbot.core import WikiBot
+from requests import Response
 from requests.exceptions import HTTPError
 
-from copy import deepcopy
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime, timedelta, timezone
 from dateutil.parser import parse as parse_datetime
-from time import time
+
+try:
+    from urllib.request import pathname2url  # py3
+except ImportError:
+    from urllib import pathname2url
 
 try:
     _ = basestring  # py2
@@ -19,11 +38,232 @@ except NameError:
 
 _default_db_name = "camptocamp.db"
 
+# indexes that can be dropped during big imports, see Dump.drop_indexes()
+_indexes = {
+    "IX_document_document_id": "UNIQUE INDEX {} ON document(document_id)",
+    "IX_locale_document_id": "INDEX {} ON locale(document_id)",
+    "IX_contribution_document_id_written_at": "INDEX {} ON contribution(document_id, written_at)",
+    "IX_contribution_user_id_written_at": "INDEX {} ON contribution(user_id, written_at)",
+    "IX_real_property_document_id": "INDEX {} ON real_property(document_id)",
+    "IX_integer_property_document_id": "INDEX {} ON integer_property(document_id)",
+    "IX_string_property_document_id": "INDEX {} ON string_property(document_id)",
+    "IX_association_child_id": "INDEX {} ON association(child_id, parent_id)",
+}
+
+# written_at is an epoch timestamp, in seconds
+_create_contribution_table = (
+    "CREATE TABLE IF NOT EXISTS contribution ("
+    " version_id INTEGER PRIMARY KEY DESC,"
+    " document_id INTEGER,"
+    " user_id INTEGER,"
+    " type CHAR(1),"
+    " written_at INTEGER,"
+    " lang CHAR(2)"
+    ") WITHOUT ROWID;"
+)
+
+_insert_statements = {
+    "locale": "INSERT INTO locale(document_id,lang,field,value) VALUES (?,?,?,?)",
+    "string_property": "INSERT INTO string_property(document_id,field,value) VALUES (?,?,?)",
+    "integer_property": "INSERT INTO integer_property(document_id,field,value) VALUES (?,?,?)",
+    "real_property": "INSERT INTO real_property(document_id,field,value) VALUES (?,?,?)",
+    "association": "INSERT OR IGNORE INTO association(parent_id,child_id,type) VALUES (?,?,?)",
+}
+
+# Dump.get_document() can't guess these types from stored values
+# list values get a marker row in string_property, whose value is a string id
+# that never exists. Documents are rebuilt with the same list values, even
+# empty or single item ones
+_list_marker = 0
+
+# booleans are stored as integers, with a marker row as lists
+_bool_marker = -1
+
+# value of a missing key, in DumpWikiBot saves
+_missing = object()
+
+# compressed locale values are blobs : a two bytes dictionary id (0 if no
+# dictionary is used) followed by zlib data
+_dictionary_id_size = 2
+
+# zlib can't use more than 32 KiB of preset dictionary
+_max_dictionary_size = 32768
+
+# dictionaries are made of words or markdown tokens, with following spaces
+_dictionary_token = re.compile(r"\S+\s*")
+
+# associations are stored as a list of ids, they are grouped by type
+_association_keys = {
+    "a": "areas",
+    "b": "books",
+    "c": "articles",
+    "i": "images",
+    "m": "maps",
+    "o": "outings",
+    "r": "routes",
+    "u": "users",
+    "w": "waypoints",
+    "x": "xreports",
+}
+
+# in an association, parent type comes first in this list. Associations of
+# documents of the same type have the smaller id as parent, except waypoints.
+_parent_types = "ambwruocxi"
+
+
+def _decompress(value, dictionaries):
+    """
+    :param value: locale value, text or compressed blob
+    :param dictionaries: compression dictionaries, by id
+
+    :return: text
+    """
+
+    if not isinstance(value, bytes):
+        return value
+
+    dictionary_id = int.from_bytes(value[:_dictionary_id_size], "big")
+
+    if dictionary_id:
+        decompressor = zlib.decompressobj(zdict=dictionaries[dictionary_id])
+    else:
+        decompressor = zlib.decompressobj()
+
+    data = decompressor.decompress(value[_dictionary_id_size:])
+    return (data + decompressor.flush()).decode("utf-8")
+
+
+def _get_association(document_id, document_type, associated_id, associated_type):
+    if (_parent_types.index(document_type), document_id) > (
+        _parent_types.index(associated_type),
+        associated_id,
+    ):
+        document_id, document_type, associated_id, associated_type = (
+            associated_id,
+            associated_type,
+            document_id,
+            document_type,
+        )
+
+    return document_id, associated_id, document_type + associated_type
+
+
+def get_associations(doc):
+    """
+    :param doc: document, as given by camptocamp.org API
+
+    :return: (association types, associations). Association types are all
+        types described by the document, even without any association.
+        Associations are (parent_id, child_id, type) tuples. Type is parent
+        and child type letters, like "wr" for a waypoint and one of its routes.
+    """
+
+    associations = dict(doc.get("associations") or {})
+    for key in ("areas", "maps"):
+        if key in doc:
+            associations[key] = doc[key] or []
+
+    types = {key: typ for typ, key in _association_keys.items()}
+    types["waypoint_children"] = "w"
+
+    association_types = set()
+    result = []
+
+    for key, items in associations.items():
+        if key not in types:  # recent_outings, all_routes...
+            continue
+
+        association_types.add(
+            "".join(sorted(doc["type"] + types[key], key=_parent_types.index))
+        )
+
+        for item in items:
+            associated_id = item["document_id"]
+            associated_type = item.get("type") or types[key]
+
+            if key == "waypoint_children":
+                result.append((doc["document_id"], associated_id, "ww"))
+            elif key == "waypoints" and doc["type"] == "w":
+                result.append((associated_id, doc["document_id"], "ww"))
+            else:
+                result.append(
+                    _get_association(
+                        doc["document_id"], doc["type"], associated_id, associated_type
+                    )
+                )
+
+    return association_types, result
+
+
+# Optional typed schema, see Dump(typed_schema=True) : one table per document
+# type, with a column for each frequently queried field
+_typed_columns = {
+    "a": ("area_type",),
+    "b": ("quality", "publication_date"),
+    "c": ("quality", "article_type"),
+    "i": ("quality", "image_type", "date_time", "elevation"),
+    "m": ("code", "editor"),
+    "o": (
+        "quality",
+        "date_start",
+        "date_end",
+        "elevation_max",
+        "height_diff_up",
+        "condition_rating",
+    ),
+    "r": (
+        "quality",
+        "main_waypoint_id",
+        "elevation_min",
+        "elevation_max",
+        "height_diff_up",
+        "global_rating",
+        "climbing_outdoor_type",
+    ),
+    "u": ("name", "forum_username"),
+    "w": ("quality", "waypoint_type", "elevation"),
+    "x": ("quality", "date", "elevation", "severity"),
+}
+
+_typed_column_types = {
+    "date_time": "INTEGER",
+    "elevation": "INTEGER",
+    "elevation_max": "INTEGER",
+    "elevation_min": "INTEGER",
+    "height_diff_up": "INTEGER",
+    "main_waypoint_id": "INTEGER",
+}
+
+# ... and junction tables for list fields, named document_<field>
+_typed_list_fields = ("activities", "categories", "orientations", "rock_types")
+
+_typed_tables = {
+    objects.get_constructor(document_type).url_path: document_type
+    for document_type in _typed_columns
+}
+
+for _table, _document_type in _typed_tables.items():
+    _insert_statements[_table] = "INSERT INTO {}(document_id,{}) VALUES (?{})".format(
+        _table,
+        ",".join(_typed_columns[_document_type]),
+        ",?" * len(_typed_columns[_document_type]),
+    )
+
+for _field in _typed_list_fields:
+    _insert_statements["document_" + _field] = (
+        "INSERT INTO document_{}(document_id,value) VALUES (?,?)".format(_field)
+    )
+
 
 def prepare_for_insertion(doc):
-    result = deepcopy(doc)
+    """
+    Reshape a document before insertion. Only the top level of the document
+    is copied, nested values are shared and must not be modified.
+    """
 
-    result["creator"] = result.pop("creator", {}).get("user_id", None)
+    result = dict(doc)
+
+    result["creator"] = (result.pop("creator", None) or {}).get("user_id", None)
     if isinstance(result.get("author", None), dict):
         result["author"] = (result.pop("author", {}) or {}).get("user_id", None)
 
@@ -32,26 +272,302 @@ def prepare_for_insertion(doc):
 
     result.pop("available_langs", None)
 
-    result["associations"] = result["associations"] or {}
-    result["associations"].pop("recent_outings", None)
-    result["associations"].pop("all_routes", None)
-    result["associations"]["maps"] = result.pop("maps", [])
-    result["associations"]["areas"] = result.pop("areas", [])
     associations = []
-    for items in result["associations"].values():
-        for item in items:
-            associations.append(item["document_id"])
+    for key, items in (result.pop("associations", None) or {}).items():
+        if key not in ("recent_outings", "all_routes"):
+            associations += [item["document_id"] for item in items]
+
+    for key in ("maps", "areas"):
+        associations += [item["document_id"] for item in result.pop(key, None) or []]
 
     result["associations"] = associations
 
     return result
 
 
+# Regular expression analysis, for full text search. Each part of a parsed
+# pattern is described by (exact, query) :
+#
+# * exact is the set of all strings the part can match, or None if this set
+#   is unknown or too big
+# * query is a condition on texts containing a match: None (any text),
+#   a string (text contains it), or ("AND"|"OR", [sub queries])
+
+_max_exact_size = 16
+
+_anything = (None, None)
+_empty_string = ({""}, None)
+_zero_width_ops = (
+    sre_constants.AT,
+    sre_constants.ASSERT,
+    sre_constants.ASSERT_NOT,
+)
+_repeat_ops = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+
+def _and_query(*queries):
+    queries = [q for q in queries if q is not None]
+
+    if len(queries) == 0:
+        return None
+
+    return queries[0] if len(queries) == 1 else ("AND", queries)
+
+
+def _or_query(queries):
+    if None in queries:
+        return None
+
+    return queries[0] if len(queries) == 1 else ("OR", queries)
+
+
+def _exact_to_query(exact):
+    if exact is None or any(len(string) < 3 for string in exact):
+        return None  # trigram tokenizer can't search shorter strings
+
+    # if "abc" is found, no need to search "xabc"
+    strings = [
+        string
+        for string in exact
+        if not any(other != string and other in string for other in exact)
+    ]
+
+    return _or_query(sorted(strings))
+
+
+def _get_char_set(items):
+    result = set()
+
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            result.add(chr(av))
+
+        elif op == sre_constants.RANGE and av[1] - av[0] < _max_exact_size:
+            result.update(chr(c) for c in range(av[0], av[1] + 1))
+
+        else:  # NEGATE, CATEGORY, big range...
+            return None
+
+    return result if len(result) <= _max_exact_size else None
+
+
+def _analyse_sequence(parsed):
+    exact, query = _empty_string
+    is_exact = True  # False once exact only describes the end of the match
+
+    for item_exact, item_query in _analyse_items(parsed):
+
+        if (
+            exact is not None
+            and item_exact is not None
+            and len(exact) * len(item_exact) <= _max_exact_size
+        ):
+            exact = {a + b for a in exact for b in item_exact}
+
+        else:
+            query = _and_query(query, _exact_to_query(exact), item_query)
+            exact = item_exact
+            is_exact = False
+
+    if not is_exact:
+        return None, _and_query(query, _exact_to_query(exact))
+
+    return exact, query
+
+
+def _analyse_items(parsed):
+    for op, av in parsed:
+        if op in _repeat_ops and av[0] >= 1 and av[1] != 1:
+            # item is repeated at least once : the match starts with the
+            # item, and ends with it
+            item = _analyse_sequence(av[2])
+            yield item
+            yield _anything
+            yield item
+
+        else:
+            yield _analyse_item(op, av)
+
+
+def _analyse_item(op, av):
+    if op == sre_constants.LITERAL:
+        return {chr(av)}, None
+
+    if op == sre_constants.IN:
+        return _get_char_set(av), None
+
+    if op in _zero_width_ops:
+        return _empty_string
+
+    if op == sre_constants.SUBPATTERN:
+        return _analyse_sequence(av[-1])
+
+    if op == sre_constants.BRANCH:
+        branches = [_analyse_sequence(branch) for branch in av[1]]
+        exacts = [exact for exact, _ in branches]
+
+        if None not in exacts and sum(map(len, exacts)) <= _max_exact_size:
+            return set().union(*exacts), None
+
+        return None, _or_query(
+            [_and_query(query, _exact_to_query(exact)) for exact, query in branches]
+        )
+
+    if op in _repeat_ops:  # at most once, see _analyse_items() for others
+        min_count, max_count, item = av
+        exact, query = _analyse_sequence(item)
+
+        if min_count == 1:
+            return exact, query
+
+        if max_count == 1 and exact is not None:
+            return exact | {""}, None
+
+    return _anything  # ANY, NOT_LITERAL, CATEGORY, GROUPREF...
+
+
+def _render_query(query):
+    if isinstance(query, tuple):
+        operator, queries = query
+        return "(" + " {} ".format(operator).join(map(_render_query, queries)) + ")"
+
+    return '"' + query.replace('"', '""') + '"'
+
+
+def get_full_text_query(pattern):
+    """
+    Build a FTS5 query that selects a superset of texts matching a regular
+    expression, or None if no query can be built (pattern without literal of
+    3 characters or more).
+    """
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+
+    exact, query = _analyse_sequence(parsed)
+    query = _and_query(query, _exact_to_query(exact))
+
+    return None if query is None else _render_query(query)
+
+
+def get_bbox(geom, geom_detail):
+    """
+    Get (min_x, max_x, min_y, max_y) of a document geometry, from its point
+    if it exists, from its detailed geometry otherwise. GeoJSON values are
+    EPSG:3857 coordinates.
+    """
+
+    geometry = geom or geom_detail
+    if geometry is None:
+        return None
+
+    xs = []
+    ys = []
+
+    def worker(coordinates):
+        if len(coordinates) == 0:
+            pass
+
+        elif isinstance(coordinates[0], (int, float)):
+            xs.append(coordinates[0])
+            ys.append(coordinates[1])
+        else:
+            for item in coordinates:
+                worker(item)
+
+    geometry = json.loads(geometry)
+    if geometry["type"] == "GeometryCollection":
+        for item in geometry["geometries"]:
+            worker(item["coordinates"])
+    else:
+        worker(geometry["coordinates"])
+
+    if len(xs) == 0:
+        return None
+
+    return min(xs), max(xs), min(ys), max(ys)
+
+
 class Dump(object):
-    def __init__(self, db_name=None):
+    def __init__(
+        self,
+        db_name=None,
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        cache_size=-65536,
+        typed_schema=False,
+        string_cache_size=100000,
+        compress_threshold=None,
+        snapshot=False,
+        mmap_size=1 << 30,
+    ):
+        """
+        :param db_name: SQLite file name, default is camptocamp.db
+        :param journal_mode: SQLite journal mode (WAL, DELETE, MEMORY...)
+        :param synchronous: SQLite synchronous level (OFF, NORMAL, FULL...)
+        :param cache_size: SQLite page cache size, in pages, or in KiB if negative
+        :param typed_schema: also fill typed tables (routes, waypoints...),
+            see campbot/sql/routes_by_activity.sql. Once created, typed
+            tables are always filled, whatever this parameter is.
+        :param string_cache_size: number of string ids kept in memory
+        :param compress_threshold: if set, locale values with at least this
+            number of characters are stored compressed. Compressed values are
+            always readable, whatever this parameter is.
+        :param snapshot: open a snapshot published by publish_snapshot(),
+            read-only and memory mapped. Snapshot file must never be modified,
+            SQLite does not lock it, and does not check if it has changed.
+        :param mmap_size: maximum size of the memory mapping, in bytes, used
+            in snapshot mode
+        """
+
         super(Dump, self).__init__()
 
-        self._conn = sqlite3.connect(db_name or _default_db_name)
+        db_name = db_name or _default_db_name
+
+        if snapshot:
+            self._conn = sqlite3.connect(
+                "file:{}?mode=ro&immutable=1".format(pathname2url(db_name)),
+                uri=True,
+            )
+        else:
+            self._conn = sqlite3.connect(db_name)
+
+        # dictionaries are loaded by _load_dictionaries(). Triggers and
+        # queries read locale values through locale_text(), it must not
+        # reference self : it would prevent the connection from being closed
+        # when the dump is deleted.
+        self._dictionaries = {}
+        self._conn.create_function(
+            "locale_text", 1, partial(_decompress, dictionaries=self._dictionaries)
+        )
+
+        def regexp(y, x, search=re.search):
+            return 1 if search(y, str(x)) else 0
+
+        self._conn.create_function("regexp", 2, regexp)
+
+        # strings are looked up on demand, most recently used ids are cached
+        self._string_ids = OrderedDict()
+        self._string_cache_size = string_cache_size
+
+        self.compress_threshold = compress_threshold
+        self.snapshot = snapshot
+
+        self._conn.execute("PRAGMA cache_size={}".format(int(cache_size)))
+
+        if snapshot:
+            self._conn.execute("PRAGMA mmap_size={}".format(int(mmap_size)))
+
+            self._load_dictionaries()
+            self.full_text_search = self._has_table("locale_fts")
+            self.spatial_index = self._has_table("document_rtree")
+            self.typed_schema = False
+            return
+
+        self._conn.execute("PRAGMA journal_mode={}".format(journal_mode))
+        self._conn.execute("PRAGMA synchronous={}".format(synchronous))
 
         self._conn.execute(
             "CREATE TABLE IF NOT EXISTS document ("
@@ -74,15 +590,8 @@ class Dump(object):
             ");"
         )
 
-        self._conn.execute(
-            "CREATE TABLE IF NOT EXISTS contribution ("
-            " version_id INTEGER PRIMARY KEY DESC,"
-            " document_id INTEGER,"
-            " user_id INTEGER,"
-            " type CHAR(1),"
-            " written_at CHAR(32)"
-            ") WITHOUT ROWID;"
-        )
+        self._conn.execute(_create_contribution_table)
+        self._migrate_contribution_table()
 
         self._conn.execute(
             "CREATE TABLE IF NOT EXISTS string_property ("
@@ -115,135 +624,568 @@ class Dump(object):
             ");"
         )
 
+        # not in _indexes, it can't be dropped : it keeps strings unique
         self._conn.execute(
-            "CREATE UNIQUE INDEX IF NOT EXISTS IX_document_document_id "
-            " ON document(document_id);"
+            "CREATE UNIQUE INDEX IF NOT EXISTS IX_string_value ON string(value);"
         )
 
-        self._conn.execute(
-            "CREATE INDEX IF NOT EXISTS IX_locale_document_id "
-            " ON locale(document_id);"
+        self._create_dictionary_table()
+
+        self._create_association_table()
+
+        self.create_indexes()
+
+        self.full_text_search = self._create_full_text_index()
+        self.spatial_index = self._create_spatial_index()
+
+        # once created, typed tables must be kept up to date
+        self.typed_schema = typed_schema or self._has_table("routes")
+
+        if self.typed_schema:
+            self._create_typed_schema()
+
+    def _has_table(self, name):
+        return (
+            self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name=?", (name,)
+            ).fetchone()
+            is not None
         )
 
+    def _migrate_contribution_table(self):
+        """
+        Old dumps have no lang column, and store written_at as ISO text
+        """
+
+        columns = {
+            row[1]: row[2]
+            for row in self._conn.execute("PRAGMA table_info(contribution)")
+        }
+
+        if "lang" not in columns:
+            self._conn.execute("ALTER TABLE contribution ADD COLUMN lang CHAR(2);")
+
+        if columns["written_at"] != "INTEGER":
+            self._conn.execute("ALTER TABLE contribution RENAME TO contribution_old;")
+            self._conn.execute(_create_contribution_table)
+            self._conn.execute(
+                "INSERT INTO contribution"
+                "(version_id, document_id, user_id, type, written_at, lang) "
+                "SELECT version_id, document_id, user_id, type,"
+                " CAST(strftime('%s', written_at) AS INTEGER), lang "
+                "FROM contribution_old;"
+            )
+            self._conn.execute("DROP TABLE contribution_old;")
+
+        self._conn.commit()
+
+    def _create_association_table(self):
+        """
+        Create association table, the document graph. It's filled with
+        associations stored as document properties if the dump is not empty.
+        """
+
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='association'"
+        ).fetchone()
+
+        if exists:
+            return
+
         self._conn.execute(
-            "CREATE INDEX IF NOT EXISTS IX_contribution_document_id "
-            " ON contribution(document_id);"
+            "CREATE TABLE association ("
+            " parent_id INTEGER,"
+            " child_id INTEGER,"
+            " type CHAR(2),"
+            " PRIMARY KEY (parent_id, child_id)"
+            ") WITHOUT ROWID;"
+        )
+
+        rows = self._conn.execute(
+            "SELECT prop.document_id, document.type, prop.value, associated.type "
+            "FROM integer_property AS prop "
+            "JOIN string ON string.string_id=prop.field AND string.value='associations' "
+            "JOIN document ON document.document_id=prop.document_id "
+            "JOIN document AS associated ON associated.document_id=prop.value"
         )
 
+        self._conn.executemany(
+            _insert_statements["association"], (_get_association(*row) for row in rows)
+        )
+
+        self._conn.commit()
+
+    def _create_full_text_index(self):
+        """
+        Create locale_fts, a FTS5 trigram index on locale values, kept up to
+        date by triggers. Returns False if SQLite does not support it.
+        """
+
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='locale_fts'"
+        ).fetchone()
+
+        if not exists:
+            try:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE locale_fts USING fts5("
+                    " value, content='locale', content_rowid='rowid',"
+                    " tokenize='trigram'"
+                    ");"
+                )
+            except sqlite3.OperationalError:  # no FTS5, or SQLite < 3.34
+                return False
+
+            # not a 'rebuild' : it would index compressed values
+            self._conn.execute(
+                "INSERT INTO locale_fts(rowid, value) "
+                "SELECT rowid, locale_text(value) FROM locale"
+            )
+
+        # triggers only index text values, and must not use locale_text() :
+        # other SQLite clients do not know it. Compressed values are indexed
+        # by insert() and _delete(). Triggers of old dumps are replaced.
+        self._conn.execute("DROP TRIGGER IF EXISTS locale_fts_insert;")
         self._conn.execute(
-            "CREATE INDEX IF NOT EXISTS IX_real_property_document_id "
-            " ON real_property(document_id);"
+            "CREATE TRIGGER locale_fts_insert AFTER INSERT ON locale "
+            "WHEN typeof(new.value)!='blob' "
+            "BEGIN"
+            " INSERT INTO locale_fts(rowid, value) VALUES (new.rowid, new.value);"
+            "END;"
         )
 
+        self._conn.execute("DROP TRIGGER IF EXISTS locale_fts_delete;")
         self._conn.execute(
-            "CREATE INDEX IF NOT EXISTS IX_integer_property_document_id "
-            " ON integer_property(document_id);"
+            "CREATE TRIGGER locale_fts_delete AFTER DELETE ON locale "
+            "WHEN typeof(old.value)!='blob' "
+            "BEGIN"
+            " INSERT INTO locale_fts(locale_fts, rowid, value)"
+            "  VALUES ('delete', old.rowid, old.value);"
+            "END;"
         )
 
+        self._conn.commit()
+
+        return True
+
+    def _create_dictionary_table(self):
+        """
+        Create compression_dictionary table, preset dictionaries used to
+        compress locale values. The last one is used for new values.
+        """
+
         self._conn.execute(
-            "CREATE INDEX IF NOT EXISTS IX_string_property_document_id "
-            " ON string_property(document_id);"
+            "CREATE TABLE IF NOT EXISTS compression_dictionary ("
+            " dictionary_id INTEGER PRIMARY KEY,"
+            " value BLOB"
+            ");"
         )
 
-        def regexp(y, x, search=re.search):
-            return 1 if search(y, str(x)) else 0
+        self._load_dictionaries()
 
-        self._conn.create_function("regexp", 2, regexp)
+    def _load_dictionaries(self):
+        self._dictionary_id = 0
+
+        if not self._has_table("compression_dictionary"):
+            return
+
+        for dictionary_id, value in self._conn.execute(
+            "SELECT dictionary_id, value FROM compression_dictionary"
+        ):
+            self._dictionaries[dictionary_id] = bytes(value)
+
+        self._dictionary_id = max(self._dictionaries, default=0)
+
+    def _compress(self, value):
+        """
+        :return: value, or a compressed blob if value is long enough and if
+            compression makes it smaller.
+        """
+
+        if self.compress_threshold is None or len(value) < self.compress_threshold:
+            return value
+
+        if self._dictionary_id:
+            compressor = zlib.compressobj(
+                9, zdict=self._dictionaries[self._dictionary_id]
+            )
+        else:
+            compressor = zlib.compressobj(9)
+
+        data = value.encode("utf-8")
+        compressed = compressor.compress(data) + compressor.flush()
+
+        if len(compressed) + _dictionary_id_size >= len(data):
+            return value
+
+        header = self._dictionary_id.to_bytes(_dictionary_id_size, "big")
+        return header + compressed
+
+    def train_dictionary(self, sample_size=5000, dictionary_size=_max_dictionary_size):
+        """
+        Build a compression dictionary from a sample of locale values : tokens
+        found in most of them, like markdown headers or frequent words. Next
+        compressed values will use it, call compress_locales() to use it on
+        existing values.
 
-        self.string_ids = {}
+        :return: dictionary id
+        """
 
-        for row in self._conn.execute("SELECT string_id, value FROM string"):
-            self.string_ids[row[1]] = row[0]
+        counts = Counter()
+        for (value,) in self._conn.execute(
+            "SELECT locale_text(value) FROM locale ORDER BY random() LIMIT ?",
+            (sample_size,),
+        ):
+            counts.update(set(_dictionary_token.findall(value)))
+
+        # tokens found once are useless, and the most useful are the ones that
+        # saves most bytes
+        tokens = sorted(
+            (token for token, count in counts.items() if count > 1),
+            key=lambda token: counts[token] * len(token.encode("utf-8")),
+            reverse=True,
+        )
+
+        selected = []
+        size = 0
+        for token in tokens:
+            token_size = len(token.encode("utf-8"))
+            if size + token_size > dictionary_size:
+                break
+            selected.append(token)
+            size += token_size
+
+        # zlib finds closer matches with fewer bits : the most useful
+        # tokens are put at the end
+        dictionary = "".join(reversed(selected)).encode("utf-8")
+
+        cur = self._conn.execute(
+            "INSERT INTO compression_dictionary(value) VALUES (?)", (dictionary,)
+        )
+        self._conn.commit()
+
+        self._dictionary_id = cur.lastrowid
+        self._dictionaries[self._dictionary_id] = dictionary
+
+        return self._dictionary_id
+
+    def compress_locales(self, batch_size=1000):
+        """
+        Compress, or re-compress with the last dictionary, all locale values
+        above compress_threshold. Run VACUUM after to shrink the file.
+        """
+
+        rows = self._conn.execute(
+            "SELECT rowid, value FROM locale "
+            "WHERE length(value)>=? OR typeof(value)='blob'",
+            (self.compress_threshold,),
+        ).fetchall()
+
+        # updates do not change decompressed values, and are not seen by
+        # full text index triggers : the index is still up to date
+        updates = []
+        for rowid, value in rows:
+            updates.append(
+                (self._compress(_decompress(value, self._dictionaries)), rowid)
+            )
+
+            if len(updates) >= batch_size:
+                self._conn.executemany(
+                    "UPDATE locale SET value=? WHERE rowid=?", updates
+                )
+                updates = []
+
+        self._conn.executemany("UPDATE locale SET value=? WHERE rowid=?", updates)
+        self._conn.commit()
+
+    def _create_spatial_index(self):
+        """
+        Create document_rtree, a R*Tree index on documents bounding boxes.
+        Returns False if SQLite does not support it.
+        """
+
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='document_rtree'"
+        ).fetchone()
+
+        if exists:
+            return True
+
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE document_rtree USING rtree("
+                " document_id, min_x, max_x, min_y, max_y"
+                ");"
+            )
+        except sqlite3.OperationalError:  # SQLite built without R*Tree
+            return False
+
+        cur = self._conn.cursor()
+        for document_id, geom, geom_detail in self._conn.execute(
+            "SELECT document_id, geometry_geom, geometry_geom_detail FROM document"
+        ):
+            self._insert_bbox(document_id, geom, geom_detail, cur)
+
+        self._conn.commit()
+
+        return True
+
+    def _create_typed_schema(self):
+        """
+        Create typed tables, and fill them if the dump is not empty.
+        """
+
+        exists = self._has_table("routes")
 
-    def get_string_id(self, string, cur):
-        if string not in self.string_ids:
-            cur.execute("INSERT INTO string(value) VALUES (?)", (string,))
-            self.string_ids[string] = cur.lastrowid
+        for table, document_type in _typed_tables.items():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                " document_id INTEGER PRIMARY KEY,{}"
+                ");".format(
+                    table,
+                    ",".join(
+                        " {} {}".format(column, _typed_column_types.get(column, "TEXT"))
+                        for column in _typed_columns[document_type]
+                    ),
+                )
+            )
+
+        for field in _typed_list_fields:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS document_{} ("
+                " document_id INTEGER,"
+                " value TEXT"
+                ");".format(field)
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS IX_document_{0}_document_id "
+                "ON document_{0}(document_id);".format(field)
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS IX_document_{0}_value "
+                "ON document_{0}(value, document_id);".format(field)
+            )
+
+        if not exists:
+            rows = defaultdict(list)
+
+            for document_id, typ in self.get_all_ids():
+                doc = prepare_for_insertion(self.get_document(document_id))
+                self._insert_typed(doc, rows)
+
+            self._write_rows(rows, self._conn.cursor())
+
+        self._conn.commit()
+
+    def _insert_typed(self, doc, rows):
+        table = objects.get_constructor(doc["type"]).url_path
+
+        values = [doc["document_id"]]
+        for column in _typed_columns[doc["type"]]:
+            value = doc.get(column)
+            values.append(",".join(value) if isinstance(value, list) else value)
 
-        return self.string_ids[string]
+        rows[table].append(values)
 
-    def _insert_prop(self, doc, key, value, cur):
+        for field in _typed_list_fields:
+            for value in doc.get(field) or []:
+                rows["document_" + field].append((doc["document_id"], value))
+
+    def _insert_bbox(self, document_id, geom, geom_detail, cur):
+        bbox = get_bbox(geom, geom_detail)
+
+        if bbox is not None:
+            cur.execute(
+                "INSERT INTO document_rtree"
+                "(document_id, min_x, max_x, min_y, max_y)"
+                "VALUES (?,?,?,?,?)",
+                (document_id,) + bbox,
+            )
+
+    def close(self):
+        self._conn.close()
+
+    def create_indexes(self):
+        for name, definition in _indexes.items():
+            self._conn.execute(
+                "CREATE " + definition.format("IF NOT EXISTS " + name) + ";"
+            )
+
+    def drop_indexes(self):
+        """
+        Drop secondary indexes. Filling an empty database is faster without
+        them, call create_indexes() once the import is done.
+        """
+
+        for name in _indexes:
+            self._conn.execute("DROP INDEX IF EXISTS {};".format(name))
+
+    def get_string_id(self, string, create=True):
+        """
+        Get the id of a string. New strings are inserted, unless create is
+        False : None is then returned.
+        """
+
+        string_id = self._string_ids.get(string)
+
+        if string_id is not None:
+            self._string_ids.move_to_end(string)
+            return string_id
+
+        row = self._conn.execute(
+            "SELECT string_id FROM string WHERE value=?", (string,)
+        ).fetchone()
+
+        if row is not None:
+            string_id = row[0]
+        elif create:
+            string_id = self._conn.execute(
+                "INSERT INTO string(value) VALUES (?)", (string,)
+            ).lastrowid
+        else:
+            return None
+
+        self._string_ids[string] = string_id
+        if len(self._string_ids) > self._string_cache_size:
+            self._string_ids.popitem(last=False)
+
+        return string_id
+
+    def _insert_prop(self, document_id, key, value, rows):
 
         if value is None:
-            return
+            # keep track of empty keys, documents can be rebuilt with them
+            key_id = self.get_string_id(key)
+            rows["string_property"].append((document_id, key_id, None))
 
-        if isinstance(value, list):
+        elif isinstance(value, list):
+            key_id = self.get_string_id(key)
+            rows["string_property"].append((document_id, key_id, _list_marker))
             for sub_value in value:
-                self._insert_prop(doc, key, sub_value, cur)
+                self._insert_prop(document_id, key, sub_value, rows)
 
         elif isinstance(value, dict):
             for sub_key in value:
-                self._insert_prop(doc, key + "." + sub_key, value[sub_key], cur)
+                self._insert_prop(
+                    document_id, key + "." + sub_key, value[sub_key], rows
+                )
 
         else:
-            key_id = self.get_string_id(key, cur)
+            key_id = self.get_string_id(key)
 
-            if isinstance(value, (bool, int)):
-                cur.execute(
-                    "INSERT INTO integer_property"
-                    "(document_id,field,value)"
-                    "VALUES (?,?,?)",
-                    (doc.document_id, key_id, value),
-                )
+            if isinstance(value, bool):
+                rows["string_property"].append((document_id, key_id, _bool_marker))
+                rows["integer_property"].append((document_id, key_id, value))
+
+            elif isinstance(value, int):
+                rows["integer_property"].append((document_id, key_id, value))
 
             elif isinstance(value, float):
-                cur.execute(
-                    "INSERT INTO real_property"
-                    "(document_id,field,value)"
-                    "VALUES (?,?,?)",
-                    (doc.document_id, key_id, value),
-                )
+                rows["real_property"].append((document_id, key_id, value))
 
             elif isinstance(value, basestring):
-                string_id = self.get_string_id(value, cur)
+                string_id = self.get_string_id(value)
+                rows["string_property"].append((document_id, key_id, string_id))
 
-                cur.execute(
-                    "INSERT INTO string_property"
-                    "(document_id,field,value)"
-                    "VALUES (?,?,?)",
-                    (doc.document_id, key_id, string_id),
-                )
             else:
                 raise NotImplementedError(key, value)
 
+    @staticmethod
+    def _write_rows(rows, cur):
+        for table, table_rows in rows.items():
+            if table_rows:
+                cur.executemany(_insert_statements[table], table_rows)
+
     def delete(self, document_id):
         cur = self._conn.cursor()
         self._delete(document_id, cur)
         self._conn.commit()
 
-    def _delete(self, document_id, cur):
+    def _delete(self, document_id, cur, association_types=None):
+        """
+        :param association_types: only delete these associations types,
+            default is all
+        """
 
         cur.execute("DELETE FROM document WHERE document_id=?", (document_id,))
+        if self.full_text_search:
+            # compressed values are not removed from the index by triggers
+            cur.execute(
+                "INSERT INTO locale_fts(locale_fts, rowid, value) "
+                "SELECT 'delete', rowid, locale_text(value) FROM locale "
+                "WHERE document_id=? AND typeof(value)='blob'",
+                (document_id,),
+            )
         cur.execute("DELETE FROM locale WHERE document_id=?", (document_id,))
         cur.execute("DELETE FROM string_property WHERE document_id=?", (document_id,))
         cur.execute("DELETE FROM integer_property WHERE document_id=?", (document_id,))
         cur.execute("DELETE FROM real_property WHERE document_id=?", (document_id,))
 
+        if self.spatial_index:
+            cur.execute(
+                "DELETE FROM document_rtree WHERE document_id=?", (document_id,)
+            )
+
+        if association_types is None:
+            cur.execute("DELETE FROM association WHERE parent_id=?", (document_id,))
+            cur.execute("DELETE FROM association WHERE child_id=?", (document_id,))
+        else:
+            types = list(association_types)
+            for column in ("parent_id", "child_id"):
+                cur.execute(
+                    "DELETE FROM association WHERE {}=? AND type IN ({})".format(
+                        column, ",".join("?" * len(types))
+                    ),
+                    [document_id] + types,
+                )
+
+        if self.typed_schema:
+            for table in _typed_tables:
+                cur.execute(
+                    "DELETE FROM {} WHERE document_id=?".format(table), (document_id,)
+                )
+
+            for field in _typed_list_fields:
+                cur.execute(
+                    "DELETE FROM document_{} WHERE document_id=?".format(field),
+                    (document_id,),
+                )
+
     def insert(self, cur, base_doc=None, version_id=0, contrib=None):
 
         if not base_doc:
             base_doc = contrib.get_full_document()
             version_id = contrib.version_id
 
-        self._delete(contrib.document.document_id, cur)
+        if "redirects_to" in base_doc:
+            association_types, associations = None, []
+        else:
+            # other associations are only known by associated documents
+            association_types, associations = get_associations(base_doc)
+
+        if contrib is not None:
+            self._delete(contrib.document.document_id, cur, association_types)
+        else:
+            self._delete(base_doc["document_id"], cur, association_types)
 
         if "redirects_to" in base_doc:
             return
 
         doc = prepare_for_insertion(base_doc)
+        document_id = doc["document_id"]
         geometry = doc.pop("geometry", None) or {}
 
         props = (
-            doc.document_id,
-            doc.type,
+            document_id,
+            doc["type"],
             version_id,
-            geometry.pop("version", None),
-            geometry.pop("geom_detail", None),
-            geometry.pop("geom", None),
+            geometry.get("version", None),
+            geometry.get("geom_detail", None),
+            geometry.get("geom", None),
             doc.pop("filename", None),
         )
 
-        assert len(geometry) == 0
+        assert set(geometry) <= {"version", "geom_detail", "geom"}
 
         cur.execute(
             "INSERT INTO document"
@@ -254,30 +1196,47 @@ class Dump(object):
             props,
         )
 
+        if self.spatial_index:
+            self._insert_bbox(document_id, props[5], props[4], cur)
+
+        rows = defaultdict(list)
+        rows["association"] = associations
+
         for key in doc:
             value = doc[key]
 
             if key == "locales":
                 for locale in value:
 
-                    lang = locale.pop("lang")
+                    lang = locale["lang"]
 
                     for field in locale:
                         value = locale[field]
                         if (
                             isinstance(value, str)
                             and len(value.strip()) != 0
-                            and field not in ("version", "topic_id")
+                            and field not in ("lang", "version", "topic_id")
                         ):
-                            field_id = self.get_string_id(field, cur)
-                            cur.execute(
-                                "INSERT INTO locale"
-                                "(document_id,lang,field,value)"
-                                "VALUES (?,?,?,?)",
-                                (doc.document_id, lang, field_id, value),
+                            field_id = self.get_string_id(field)
+                            rows["locale"].append(
+                                (document_id, lang, field_id, self._compress(value))
                             )
             else:
-                self._insert_prop(doc, key, value, cur)
+                self._insert_prop(document_id, key, value, rows)
+
+        if self.typed_schema:
+            self._insert_typed(doc, rows)
+
+        self._write_rows(rows, cur)
+
+        if self.full_text_search and self.compress_threshold is not None:
+            # compressed values are not indexed by triggers
+            cur.execute(
+                "INSERT INTO locale_fts(rowid, value) "
+                "SELECT rowid, locale_text(value) FROM locale "
+                "WHERE document_id=? AND typeof(value)='blob'",
+                (document_id,),
+            )
 
     def select(self, document_id):
         sql = "SELECT * FROM document WHERE document_id=?;"
@@ -292,6 +1251,286 @@ class Dump(object):
 
         return result
 
+    def get_document(self, document_id):
+        """
+        Rebuild a document, like camptocamp.org API gives it. Stored data is
+        partial : empty locale fields, versions of locales and properties of
+        associated documents are missing.
+
+        :return: dict, or None if document is not in the dump
+        """
+
+        row = self._conn.execute(
+            "SELECT type, filename, geometry_version, geometry_geom,"
+            " geometry_geom_detail "
+            "FROM document WHERE document_id=?",
+            (document_id,),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        typ, filename, geometry_version, geom, geom_detail = row
+
+        result = {"document_id": document_id, "type": typ}
+
+        if (geometry_version, geom, geom_detail) != (None, None, None):
+            result["geometry"] = {
+                "version": geometry_version,
+                "geom": geom,
+                "geom_detail": geom_detail,
+            }
+
+        if filename is not None:
+            result["filename"] = filename
+
+        locales = {}
+        for lang, field, value in self._conn.execute(
+            "SELECT locale.lang, string.value, locale_text(locale.value) FROM locale "
+            "JOIN string ON string.string_id=locale.field "
+            "WHERE locale.document_id=? ORDER BY locale.rowid",
+            (document_id,),
+        ):
+            locales.setdefault(lang, {"lang": lang})[field] = value
+
+        result["locales"] = list(locales.values())
+        result["available_langs"] = list(locales)
+
+        values = defaultdict(list)
+        list_keys, bool_keys = set(), set()
+        for table, columns, join in (
+            (
+                "string_property",
+                "prop.value, string.value",
+                "LEFT JOIN string ON string.string_id=prop.value ",
+            ),
+            ("integer_property", "NULL, prop.value", ""),
+            ("real_property", "NULL, prop.value", ""),
+        ):
+            for key, raw_value, value in self._conn.execute(
+                "SELECT field.value, {} FROM {} AS prop "
+                "JOIN string AS field ON field.string_id=prop.field "
+                "{}"
+                "WHERE prop.document_id=? ORDER BY prop.rowid".format(
+                    columns, table, join
+                ),
+                (document_id,),
+            ):
+                if raw_value == _list_marker:
+                    list_keys.add(key)
+                    values.setdefault(key, [])
+                elif raw_value == _bool_marker:
+                    bool_keys.add(key)
+                else:
+                    values[key].append(value)
+
+        association_ids = [i for i in values.pop("associations", []) if i is not None]
+
+        for key, items in values.items():
+            if key in list_keys:
+                value = items
+            elif len(items) == 1:
+                value = items[0]
+            else:
+                value = items
+
+            if value is not None:
+                if key in bool_keys and key in list_keys:
+                    value = [bool(item) for item in value]
+                elif key in bool_keys:
+                    value = bool(value)
+                elif key in ("creator", "author"):
+                    value = {"user_id": value}
+                elif key == "date_time":
+                    value = datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+            # dict values are stored with dotted keys
+            target = result
+            path = key.split(".")
+            for sub_key in path[:-1]:
+                target = target.setdefault(sub_key, {})
+            target[path[-1]] = value
+
+        types = dict(
+            self._conn.execute(
+                "SELECT document_id, type FROM document WHERE document_id IN ({})".format(
+                    ",".join("?" * len(association_ids))
+                ),
+                association_ids,
+            )
+        )
+
+        associations = {key: [] for key in _association_keys.values()}
+        for associated_id in association_ids:
+            if associated_id in types:  # may be missing in dump
+                associations[_association_keys[types[associated_id]]].append(
+                    {"document_id": associated_id, "type": types[associated_id]}
+                )
+
+        result["areas"] = associations.pop("areas", [])
+        result["maps"] = associations.pop("maps", [])
+        result["associations"] = associations
+
+        return result
+
+    def get_document_ids(self, document_type, associated_ids=()):
+        """
+        :param document_type: type letter ('r' for route, 'w' for waypoint...)
+        :param associated_ids: list of id lists. Documents must be associated
+            to at least one id of each list.
+
+        :return: list of document ids, newest first
+        """
+
+        sql = "SELECT document_id FROM document WHERE type=?"
+        args = [document_type]
+
+        for ids in associated_ids:
+            sql += (
+                " AND (document_id IN (SELECT child_id FROM association"
+                " WHERE parent_id IN ({0}))"
+                " OR document_id IN (SELECT parent_id FROM association"
+                " WHERE child_id IN ({0})))".format(",".join("?" * len(ids)))
+            )
+            args += list(ids) * 2
+
+        sql += " ORDER BY document_id DESC"
+
+        return [row[0] for row in self._conn.execute(sql, args)]
+
+    def get_associated_ids(self, document_id, *path):
+        """
+        Follow associations in the document graph, in one query. Each step of
+        path is made of two type letters : "ro" goes from a route to its
+        outings, "ou" from an outing to its users. "ww" goes from a waypoint
+        to its children, other steps between documents of the same type ("rr",
+        "oo"...) follow associations both ways.
+
+        >>> dump.get_associated_ids(waypoint_id, "wr", "ro")  # outings
+
+        :return: sorted list of document ids
+        """
+
+        # each step is a common table expression, with the ids it reaches
+        steps = ["s0(id) AS (SELECT ?)"]
+        args = [document_id]
+
+        for i, step in enumerate(path):
+            link_type = "".join(sorted(step, key=_parent_types.index))
+            if step[0] == link_type[0]:
+                directions = [("parent_id", "child_id")]
+            else:
+                directions = [("child_id", "parent_id")]
+
+            # associations between documents of the same type (except
+            # waypoint children) have no direction
+            if step[0] == step[1] and step != "ww":
+                directions.append(("child_id", "parent_id"))
+
+            steps.append(
+                "s{}(id) AS ({})".format(
+                    i + 1,
+                    " UNION ".join(
+                        "SELECT a.{2} FROM s{0} "
+                        "JOIN association AS a ON a.{1}=s{0}.id "
+                        "WHERE a.type=?".format(i, source, target)
+                        for source, target in directions
+                    ),
+                )
+            )
+            args += [link_type] * len(directions)
+
+        sql = "WITH {} SELECT DISTINCT id FROM s{} ORDER BY 1".format(
+            ", ".join(steps), len(path)
+        )
+
+        return [row[0] for row in self._conn.execute(sql, args)]
+
+    def get_users_from_route(self, route_id):
+        """
+        :return: ids of users having an outing on this route
+        """
+
+        return self.get_associated_ids(route_id, "ro", "ou")
+
+    def get_contributions(self, user_id=None, oldest_date=None, newest_date=None):
+        """
+        :param oldest_date: epoch timestamp, included
+        :param newest_date: epoch timestamp, excluded
+
+        :return: generator of (version_id, document_id, type, user_id,
+            written_at, lang), newest first. written_at is an epoch timestamp.
+        """
+
+        sql = (
+            "SELECT version_id, document_id, type, user_id, written_at, lang "
+            "FROM contribution WHERE 1"
+        )
+        args = []
+
+        if user_id is not None:
+            sql += " AND user_id=?"
+            args.append(user_id)
+
+        if oldest_date is not None:
+            sql += " AND written_at>=?"
+            args.append(oldest_date)
+
+        if newest_date is not None:
+            sql += " AND written_at<?"
+            args.append(newest_date)
+
+        sql += " ORDER BY version_id DESC"
+
+        return self._conn.execute(sql, args)
+
+    def get_contributor_counts(self, newest_date=None, excluded_types=("i",)):
+        """
+        Same as campbot/sql/contrib_count.sql
+
+        :param newest_date: epoch timestamp, only older contributions count
+        :param excluded_types: these document types are not counted
+
+        :return: list of (user_id, number of contributed documents), biggest
+            contributors first
+        """
+
+        sql = (
+            "SELECT user_id, count(DISTINCT document_id) AS contribs "
+            "FROM contribution WHERE type NOT IN ({})".format(
+                ",".join("?" * len(excluded_types))
+            )
+        )
+        args = list(excluded_types)
+
+        if newest_date is not None:
+            sql += " AND written_at<?"
+            args.append(newest_date)
+
+        sql += " GROUP BY user_id ORDER BY contribs DESC, user_id"
+
+        return self._conn.execute(sql, args).fetchall()
+
+    def get_version_ids(self, document_ids, chunk_size=500):
+        """
+        :return: {document_id: stored version_id}, for stored documents
+        """
+
+        document_ids = list(document_ids)
+        result = {}
+
+        for i in range(0, len(document_ids), chunk_size):
+            chunk = document_ids[i : i + chunk_size]
+            result.update(
+                self._conn.execute(
+                    "SELECT document_id, version_id FROM document "
+                    "WHERE document_id IN ({})".format(",".join("?" * len(chunk))),
+                    chunk,
+                )
+            )
+
+        return result
+
     def get_highest_version_id(self, table="document"):
         sql = "SELECT version_id from {} ORDER BY version_id DESC LIMIT 1".format(table)
 
@@ -324,14 +1563,15 @@ class Dump(object):
             try:
                 cur.execute(
                     "INSERT INTO contribution"
-                    "(document_id, type, version_id, user_id, written_at)"
-                    "VALUES (?,?,?,?,?)",
+                    "(document_id, type, version_id, user_id, written_at, lang)"
+                    "VALUES (?,?,?,?,?,?)",
                     (
                         doc.document_id,
                         doc.type,
                         contrib.version_id,
                         contrib.user.user_id,
-                        contrib.written_at,
+                        int(parse_datetime(contrib.written_at).timestamp()),
+                        contrib.lang,
                     ),
                 )
             except sqlite3.IntegrityError:
@@ -339,38 +1579,117 @@ class Dump(object):
 
         self._conn.commit()
 
-    def complete(self):
+    def complete(self, workers=8, batch_size=50, snapshot=None):
+        """
+        Insert documents modified since the last update. Documents are
+        downloaded by a pool of workers threads, and written by this thread.
+
+        :param workers: number of concurrent downloads
+        :param batch_size: number of documents per transaction
+        :param snapshot: if set, file name of a snapshot published once the
+            dump is up to date, see publish_snapshot()
+        """
 
         bot = CampBot(min_delay=0.01)
 
-        still_done = []
+        still_done = set()
         highest_version_id = self.get_highest_version_id()
 
-        cur = self._conn.cursor()
-
-        for i, contrib in enumerate(
-            bot.wiki.get_contributions(oldest_date="2018-01-24")
-        ):
+        # contributions feed goes from newest to oldest. The first contribution
+        # seen on a document is its newest version, this is the one we keep.
+        contributions = []
+        for contrib in bot.wiki.get_contributions(oldest_date="2018-01-24"):
             if highest_version_id >= contrib.version_id:
                 break
 
             key = (contrib.document.document_id, contrib.document.type)
             if key not in still_done:
-                still_done.append(key)
-                doc = contrib.get_full_document()
-
-                self.insert(
-                    cur=cur,
-                    contrib=contrib,
-                    version_id=contrib.version_id,
-                    base_doc=doc,
-                )
-                print(i, contrib.written_at, key, "inserted")
+                still_done.add(key)
+                contributions.append(contrib)
+
+        # do not download documents already stored with this version, or newer
+        version_ids = self.get_version_ids(
+            c.document.document_id for c in contributions
+        )
+        contributions = [
+            c
+            for c in contributions
+            if version_ids.get(c.document.document_id, -1) < c.version_id
+        ]
+
+        # Documents are written from oldest to newest version. If the process
+        # is interrupted, the highest committed version is then a safe
+        # starting point for the next call
+        contributions.reverse()
+
+        cur = self._conn.cursor()
+
+        fetched = _prefetch(contributions, lambda c: c.get_full_document(), workers)
+        for i, (contrib, future) in enumerate(fetched):
+            self.insert(
+                cur=cur,
+                contrib=contrib,
+                version_id=contrib.version_id,
+                base_doc=future.result(),
+            )
+            print(i, contrib.written_at, contrib.document.document_id, "inserted")
+
+            if (i + 1) % batch_size == 0:
+                self._conn.commit()
 
         self._conn.commit()
 
         self.complete_contributions()
 
+        if snapshot:
+            self.publish_snapshot(snapshot)
+
+    def publish_snapshot(self, filename):
+        """
+        Copy the dump into a snapshot file, to be opened with
+        Dump(filename, snapshot=True). The copy is written in a temporary
+        file, then renamed : readers of the previous snapshot keep reading
+        it, new readers get the new one.
+        """
+
+        self._conn.commit()
+
+        temp_filename = "{}.{}.tmp".format(filename, os.getpid())
+
+        if not hasattr(self._conn, "backup"):  # python < 3.7
+            self._copy_database(temp_filename)
+
+        target = sqlite3.connect(temp_filename)
+
+        try:
+            if hasattr(self._conn, "backup"):
+                self._conn.backup(target)
+            # a snapshot is a single file, without WAL
+            target.execute("PRAGMA journal_mode=DELETE")
+            target.close()
+        except Exception:
+            target.close()
+            os.remove(temp_filename)
+            raise
+
+        os.replace(temp_filename, filename)
+
+    def _copy_database(self, filename):
+        """
+        Copy database files, while writes are locked. A copied WAL file is
+        merged in the copy when it is opened.
+        """
+
+        db_name = self._conn.execute("PRAGMA database_list").fetchone()[2]
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            shutil.copyfile(db_name, filename)
+            if os.path.exists(db_name + "-wal"):
+                shutil.copyfile(db_name + "-wal", filename + "-wal")
+        finally:
+            self._conn.rollback()
+
     def sql_file(self, filename):
         with open(filename) as f:
             sql = " ".join(f.readlines())
@@ -378,28 +1697,114 @@ class Dump(object):
         return self._conn.execute(sql)
 
     def search(self, pattern, lang=None):
+        """
+        Search a regular expression in all locale fields, except titles.
+        If the pattern contains some literal text, the full text index
+        gives candidates rows, and the regular expression is only tested
+        on them.
+
+        :return: list of (document_id, type, lang, field, title, value)
+        """
+
         sql = (
-            "SELECT document.document_id, document.type, locale.lang, string.value, title.value, locale.value "
+            "SELECT document.document_id, document.type, locale.lang, string.value,"
+            " locale_text(title.value), locale_text(locale.value) "
             "FROM locale "
             "LEFT JOIN document ON document.document_id=locale.document_id "
             "LEFT JOIN string ON string.string_id=locale.field "
             "LEFT JOIN locale as title ON document.document_id=title.document_id "
             "   AND title.lang=locale.lang "
-            "   AND title.field=29 "
-            "WHERE locale.value REGEXP ? "
+            "   AND title.field=? "
+            "WHERE locale_text(locale.value) REGEXP ? "
             "AND string.value!='title' AND string.value!='title_prefix'"
         )
 
+        args = [self.get_string_id("title", create=False), pattern]
+
+        full_text_query = self.full_text_search and get_full_text_query(pattern)
+
+        if full_text_query:
+            sql += (
+                " AND locale.rowid IN "
+                "(SELECT rowid FROM locale_fts WHERE locale_fts MATCH ?)"
+            )
+            args.append(full_text_query)
+
         if lang is not None:
             sql += " AND locale.lang=?"
-            args = (pattern, lang)
-        else:
-            args = (pattern,)
+            args.append(lang)
 
         c = self._conn.cursor()
         c.execute(sql, args)
         return c.fetchall()
 
+    def nearest(self, longitude, latitude, radius, document_type=None):
+        """
+        Get documents near a point, with the same filter and distances as
+        find_closest_documents() : the bounding box of their geometry
+        intersects the square of `radius` around the point, and distance is
+        computed to their point, in meters. Coordinates and radius are
+        EPSG:3857 values.
+
+        :param document_type: type letter ('r' for route, 'w' for waypoint...)
+
+        :return: list of (document_id, type, distance, coordinates), closest
+            first. coordinates are (x, y) of document point. Documents without
+            point (areas, maps) have None values, and are the last ones.
+        """
+
+        min_x, max_x = longitude - radius, longitude + radius
+        min_y, max_y = latitude - radius, latitude + radius
+
+        if self.spatial_index:
+            sql = (
+                "SELECT document.document_id, document.type,"
+                " document.geometry_geom, document.geometry_geom_detail "
+                "FROM document_rtree "
+                "JOIN document ON document.document_id=document_rtree.document_id "
+                "WHERE max_x>=? AND min_x<=? AND max_y>=? AND min_y<=?"
+            )
+            args = [min_x, max_x, min_y, max_y]
+        else:
+            sql = (
+                "SELECT document_id, type, geometry_geom, geometry_geom_detail "
+                "FROM document WHERE 1"
+            )
+            args = []
+
+        if document_type is not None:
+            sql += " AND document.type=?"
+            args.append(document_type)
+
+        documents = []
+
+        for document_id, typ, geom, geom_detail in self._conn.execute(sql, args):
+            if not self.spatial_index:
+                bbox = get_bbox(geom, geom_detail)
+                if (
+                    bbox is None
+                    or bbox[1] < min_x
+                    or bbox[0] > max_x
+                    or bbox[3] < min_y
+                    or bbox[2] > max_y
+                ):
+                    continue
+
+            coordinates = None if geom is None else utils.get_point(geom)
+            documents.append((document_id, typ, coordinates))
+
+        distances = utils.compute_distances(
+            (longitude, latitude), [coordinates for _, _, coordinates in documents]
+        )
+
+        result = [
+            (document_id, typ, distance, coordinates)
+            for (document_id, typ, coordinates), distance in zip(documents, distances)
+        ]
+        result.sort(key=lambda item: (item[2] is None, item[2] or 0))
+
+        return result
+
     def get_all_ids(self):
 
         sql = "SELECT document_id, type FROM document"
@@ -423,9 +1828,7 @@ class Dump(object):
 
         return [r[0] for r in result]
 
-    def re_update(self):
-        from campbot import CampBot
-
+    def re_update(self, workers=8, batch_size=50):
         # c = self._conn.execute("SELECT document.document_id, document.type FROM document "
         #                        "LEFT OUTER JOIN string_property "
         #                        "    ON string_property.document_id = document.document_id "
@@ -440,17 +1843,17 @@ class Dump(object):
         result = c.fetchall()
 
         bot = CampBot(min_delay=0.01)
-        cur = None
+        cur = self._conn.cursor()
 
-        for i, (document_id, typ) in enumerate(result):
-            if i % 50 == 0:
-                self._conn.commit()
-                cur = self._conn.cursor()
+        def fetch(item):
+            document_id, typ = item
+            return bot.wiki.get_wiki_object(item_id=document_id, document_type=typ)
 
-            t = time()
+        for i, ((document_id, typ), future) in enumerate(
+            _prefetch(result, fetch, workers)
+        ):
             try:
-                doc = bot.wiki.get_wiki_object(item_id=document_id, document_type=typ)
-                get_time = int((time() - t) * 1000)
+                doc = future.result()
                 doc["document_id"] = document_id  # for redirects...
             except HTTPError as e:
                 if e.response.status_code == 404:
@@ -459,21 +1862,275 @@ class Dump(object):
                 else:
                     raise
             else:
-                t = time()
                 self.insert(cur=cur, base_doc=doc)
-                print(
-                    "{}/{}".format(i, len(result)),
-                    document_id,
-                    typ,
-                    get_time,
-                    int((time() - t) * 1000),
-                )
+                print("{}/{}".format(i, len(result)), document_id, typ)
+
+            if (i + 1) % batch_size == 0:
+                self._conn.commit()
 
         self._conn.commit()
 
 
+class DumpWikiBot(WikiBot):
+    """
+    WikiBot that reads documents and contributions in a Dump, instead of
+    camptocamp.org API. Other requests, and all writes, are sent to the API.
+
+    Dump documents are partial, so when a document is saved, its locales
+    are copied on the API document, which must have the same version.
+    """
+
+    def __init__(self, campbot, api_url, dump, proxies=None, min_delay=None):
+        super(DumpWikiBot, self).__init__(
+            campbot, api_url, proxies=proxies, min_delay=min_delay
+        )
+        self.dump = dump
+        self._user_names = {}
+
+    def _build_wiki_object(self, constructor, data):
+        # empty locale fields are not stored. They are added before
+        # building the object : they are not modifications.
+        for locale in data.get("locales") or []:
+            for field in objects.Locale.get_locale_fields():
+                locale.setdefault(field, None)
+
+        return constructor(self.campbot, data)
+
+    def get_wiki_object(self, item_id, document_type=None, constructor=None):
+        if not constructor:
+            constructor = objects.get_constructor(document_type)
+
+        data = self.dump.get_document(item_id)
+
+        if data is None:
+            response = Response()
+            response.status_code = 404
+            raise HTTPError(
+                "Document {} is not in dump".format(item_id), response=response
+            )
+
+        return self._build_wiki_object(constructor, data)
+
+    def get_documents(self, filters=None, document_type=None, constructor=None):
+        if not constructor:
+            constructor = objects.get_constructor(document_type=document_type)
+
+        for doc in self.get_documents_raw(constructor.url_path, filters):
+            yield self._build_wiki_object(constructor, doc)
+
+    def get_documents_raw(self, url_path, filters=None):
+        document_type = {
+            objects.get_constructor(t).url_path: t for t in _association_keys
+        }[url_path]
+
+        associated_ids = []
+        tests = []
+
+        for key, value in (filters or {}).items():
+            if isinstance(value, (list, set, tuple)):
+                values = [str(v) for v in value]
+            else:
+                values = str(value).replace("%2C", ",").split(",")
+
+            if key in ("offset", "limit", "pl"):
+                pass
+            elif key in _association_keys:
+                associated_ids.append([int(v) for v in values])
+            elif key == "act":
+                tests.append(
+                    lambda doc, values=values: any(
+                        act in values for act in doc.get("activities", [])
+                    )
+                )
+            elif key == "qa":
+                tests.append(lambda doc, values=values: doc.get("quality") in values)
+            elif key == "bbox":
+                tests.append(
+                    lambda doc, bbox=[float(v) for v in values]: _is_in_bbox(doc, bbox)
+                )
+            else:
+                raise NotImplementedError("Filter {} is not supported".format(key))
+
+        for document_id in self.dump.get_document_ids(document_type, associated_ids):
+            doc = self.dump.get_document(document_id)
+
+            if all(test(doc) for test in tests):
+                yield doc
+
+    def _get_user_name(self, user_id):
+        if user_id not in self._user_names:
+            user = self.dump.get_document(user_id) or {}
+            self._user_names[user_id] = user.get("name")
+
+        return self._user_names[user_id]
+
+    def get_contributions(self, **kwargs):
+        oldest_date = kwargs.get("oldest_date", None) or utils.today() + timedelta(
+            days=-1
+        )
+        newest_date = kwargs.get("newest_date", None) or datetime.now()
+
+        if isinstance(oldest_date, basestring):
+            oldest_date = parse_datetime(oldest_date)
+
+        if isinstance(newest_date, basestring):
+            newest_date = parse_datetime(newest_date)
+
+        oldest_date = oldest_date.replace(tzinfo=timezone.utc)
+        newest_date = newest_date.replace(tzinfo=timezone.utc)
+
+        contributions = self.dump.get_contributions(
+            kwargs.get("user_id", None),
+            oldest_date=oldest_date.timestamp(),
+            newest_date=newest_date.timestamp(),
+        )
+
+        for version_id, document_id, typ, user_id, written_at, lang in contributions:
+            name = self._get_user_name(user_id)
+            written_at = datetime.fromtimestamp(written_at, timezone.utc)
+
+            yield objects.Contribution(
+                self.campbot,
+                {
+                    "version_id": version_id,
+                    "written_at": written_at.isoformat(),
+                    "lang": lang,
+                    "comment": "",
+                    "user": {"user_id": user_id, "name": name, "username": name},
+                    "document": {"document_id": document_id, "type": typ},
+                },
+            )
+
+    def put(self, url, data):
+        if isinstance(data, dict) and isinstance(data.get("document"), dict):
+            data = dict(data, document=self._get_live_document(url, data["document"]))
+
+        return super(DumpWikiBot, self).put(url, data)
+
+    def _get_live_document(self, url, document):
+        live_document = self.get(url)
+
+        if live_document.get("version") != document.get("version"):
+            raise Exception(
+                "{} has been modified since the dump, save aborted".format(url)
+            )
+
+        # dump misses some data (associations with documents outside the
+        # dump, locale versions...) : only modifications are merged
+        return _merge_changes(document, document, live_document)
+
+def _get_item_id(item):
+    if isinstance(item, dict):
+        return item.get("document_id", item.get("lang"))
+
+    return None
+
+
+def _merge_changes(old, new, live):
+    """
+    Three-way merge : returns live value with all changes from old to new.
+    Locales and associated documents are matched on lang and document id.
+    _missing stands for a missing value.
+    """
+
+    if isinstance(new, objects.BotObject) and new is old:
+        # object tracks its own modifications
+        old = new._original
+
+    if isinstance(old, dict) and isinstance(new, dict) and isinstance(live, dict):
+        merged = dict(live)
+
+        for key in set(old) | set(new):
+            value = _merge_changes(
+                old.get(key, _missing), new.get(key, _missing), live.get(key, _missing)
+            )
+
+            if value is _missing:
+                merged.pop(key, None)
+            else:
+                merged[key] = value
+
+        return merged
+
+    if (
+        isinstance(old, list)
+        and isinstance(new, list)
+        and isinstance(live, list)
+        and all(_get_item_id(item) is not None for item in old + new + live)
+    ):
+        old_items = {_get_item_id(item): item for item in old}
+        new_items = {_get_item_id(item): item for item in new}
+        merged = []
+
+        for item in live:
+            item_id = _get_item_id(item)
+
+            if item_id in new_items:
+                merged.append(
+                    _merge_changes(
+                        old_items.get(item_id, _missing), new_items[item_id], item
+                    )
+                )
+            elif item_id not in old_items:  # removed ones are dropped
+                merged.append(item)
+
+        live_ids = {_get_item_id(item) for item in live}
+        merged += [
+            item
+            for item in new
+            if _get_item_id(item) not in old_items
+            and _get_item_id(item) not in live_ids
+        ]
+
+        return merged
+
+    return live if old == new else new
+
+
+def _is_in_bbox(doc, bbox):
+    geometry = doc.get("geometry") or {}
+    doc_bbox = get_bbox(geometry.get("geom"), geometry.get("geom_detail"))
+
+    if doc_bbox is None:
+        return False
+
+    min_x, max_x, min_y, max_y = doc_bbox
+
+    return (
+        max_x >= bbox[0] and min_x <= bbox[2] and max_y >= bbox[1] and min_y <= bbox[3]
+    )
+
+
+def _prefetch(items, fetch, workers):
+    """
+    Call fetch(item) for all items in a thread pool, with a bounded number
+    of pending calls. Yields (item, future) tuples, in items order.
+    """
+
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for item in items:
+                pending.append((item, executor.submit(fetch, item)))
+
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft()
+
+            while pending:
+                yield pending.popleft()
+
+        finally:  # consumer has stopped, do not download useless documents
+            for _, future in pending:
+                future.cancel()
+
+
 def get_document_types():
-    return {doc_id: typ for doc_id, typ in Dump().get_all_ids()}
+    dump = Dump()
+    result = {doc_id: typ for doc_id, typ in dump.get_all_ids()}
+    dump.close()
+
+    return result
 
 
 def _search(pattern, lang=None):
@@ -491,6 +2148,8 @@ def _search(pattern, lang=None):
 
             f.write("{}|{}\n".format(doc_id, typ))
 
+    dump.close()
+
 
 if __name__ == "__main__":
     # pre parser release
@@ -25,8 +25,11 @@ We try to use the second way every times it's possible in this documentation.
 from __future__ import print_function, unicode_literals, division
 
 import re
+import sys
+import copy
 import logging
-from .differ import get_diff_report
+from .differ import flatten, get_flat_diff_report
+from . import utils
 
 
 def _input(message):  # pragma: no cover
@@ -51,39 +54,135 @@ def get_constructor(document_type):
     }[document_type]
 
 
+def get_document_type(constructor):
+    """
+    Reverse of get_constructor()
+    """
+
+    for document_type in "uawoimxcbr":
+        if get_constructor(document_type) is constructor:
+            return document_type
+
+    raise KeyError(constructor)
+
+
+# original value of a key that did not exist
+_missing = object()
+
+
+class _ItemAttribute(object):
+    """
+    Attribute mirroring an item. Frequently used keys get one : it's much
+    faster than BotObject.__getattr__, only called after a failed lookup.
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        try:
+            return dict.__getitem__(instance, self.key)
+        except KeyError:
+            raise AttributeError(
+                "Object {} has not attribute {}".format(owner.__name__, self.key)
+            )
+
+    def __set__(self, instance, value):
+        instance[self.key] = value
+
+
 class BotObject(dict):
     """
     Base class for all data object
     """
 
+    # original items, a class attribute to be available while unpickling
+    _original = None
+
+    # item types copied on creation : they can be modified in place
+    _copied_types = (list, dict)
+
     def __init__(self, campbot, data):
         super(BotObject, self).__init__(data)
-        self._campbot = campbot
-
-    # make instance.key equivalent to instance["key"]
-    def __getattr__(self, item):
-        if item.startswith("_"):
-            raise AttributeError(
-                "Object {} has not attribute {}".format(self.__class__.__name__, item)
-            )
 
-        if item not in self:  # pragma: no cover
-            print("666777", self)
-            raise AttributeError(
-                "Object {} has not attribute {}".format(self.__class__.__name__, item)
+        # items are compared to original ones to find modified keys
+        original = dict(self)
+        object.__setattr__(self, "_campbot", campbot)
+        object.__setattr__(self, "_original", original)
+
+        copied_types = self._copied_types
+        if copied_types:
+            dict.update(
+                self,
+                {
+                    key: value.copy()
+                    for key, value in original.items()
+                    if type(value) in copied_types
+                },
             )
 
-        return self[item]
+    # make instance.key equivalent to instance["key"]. It's only called when
+    # item is not a real attribute.
+    def __getattr__(self, item):
+        if item[:1] != "_":
+            try:
+                return self[item]
+            except KeyError:
+                pass
+
+        raise AttributeError(
+            "Object {} has not attribute {}".format(self.__class__.__name__, item)
+        )
 
     def __setattr__(self, key, value):
-        if key in self:
+        # private attributes are never data, no need to look for them
+        if key[:1] != "_" and key in self:
             self[key] = value
         else:
-            super(BotObject, self).__setattr__(key, value)
+            object.__setattr__(self, key, value)
+
+    def __deepcopy__(self, memo):
+        # bots are shared by all objects, and hold a session and a lock
+        memo[id(self._campbot)] = self._campbot
+
+        result = dict.__new__(self.__class__)
+        memo[id(self)] = result
+        dict.update(result, copy.deepcopy(dict.copy(self), memo))
+        result.__dict__.update(copy.deepcopy(self.__dict__, memo))
+
+        return result
+
+    def get_modified_keys(self):
+        """
+        :return: list of keys whose value has been modified, added or deleted.
+            Modifications inside lists and dicts are seen on the first level
+            only, unless their items are BotObject.
+        """
+
+        original = self._original
+        if original is None:
+            return []
+
+        result = [
+            key
+            for key, value in dict.items(self)
+            if original.get(key, _missing) != value
+        ]
+        result += [key for key in original if key not in self]
+
+        return result
 
     def _convert_list(self, name, constructor):
+        # conversion is not a modification
         if name in self:
-            self[name] = [constructor(self._campbot, data) for data in self[name]]
+            dict.__setitem__(
+                self, name, [constructor(self._campbot, data) for data in self[name]]
+            )
 
     # def _convert_dict(self, name, constructor):
     #     if name in self:
@@ -146,6 +245,12 @@ class Locale(BotObject):
     Locale is a set of field, given a lang.
     """
 
+    _copied_types = ()  # only texts and numbers
+
+    lang = _ItemAttribute("lang")
+    title = _ItemAttribute("title")
+    description = _ItemAttribute("description")
+
     def get_title(self):
         """
         Get the title, with prefix if it exists.
@@ -158,7 +263,8 @@ class Locale(BotObject):
         else:
             return self.title
 
-    def get_locale_fields(self):
+    @staticmethod
+    def get_locale_fields():
         return (
             "description",
             "gear",
@@ -192,20 +298,62 @@ class Locale(BotObject):
 
 class WikiObject(BotObject):
     """
-    Base object for all wiki documents
+    Base object for all wiki documents. Locales and associations are wrapped
+    on first attribute access (document.locales), items give raw data until
+    then.
     """
 
     url_path = None
 
+    _coordinates = None  # cache : (geom, coordinates)
+    _locale_index = None  # cache : (locales, length, {lang: locale})
+
+    document_id = _ItemAttribute("document_id")
+    type = _ItemAttribute("type")
+    version = _ItemAttribute("version")
+    activities = _ItemAttribute("activities")
+
     def __init__(self, campbot, data):
         super(WikiObject, self).__init__(campbot, data)
 
-        if "associations" in self and self["associations"] is not None:
-            self["associations"] = BotObject(campbot=campbot, data=self["associations"])
-            self.associations._convert_list("images", Image)
+        # wrapped on first access, unless they are replaced
+        object.__setattr__(
+            self,
+            "_unwrapped",
+            {
+                "locales": dict.get(self, "locales"),
+                "associations": dict.get(self, "associations"),
+            },
+        )
+
+    @property
+    def locales(self):
+        locales = dict.get(self, "locales")
 
-        self._convert_list("locales", Locale)
-        self._data = data
+        if locales is not None and locales is self._unwrapped.get("locales"):
+            del self._unwrapped["locales"]
+            locales = [Locale(self._campbot, locale) for locale in locales]
+            dict.__setitem__(self, "locales", locales)
+            # locales modify themselves, the list is compared to find
+            # added and removed ones
+            self._original["locales"] = list(locales)
+
+        return locales
+
+    @property
+    def associations(self):
+        associations = dict.get(self, "associations")
+
+        if associations is not None and associations is self._unwrapped.get(
+            "associations"
+        ):
+            del self._unwrapped["associations"]
+            associations = BotObject(campbot=self._campbot, data=associations)
+            associations._convert_list("images", Image)
+            dict.__setitem__(self, "associations", associations)
+            self._original["associations"] = associations
+
+        return associations
 
     def get_url(self, lang=None):
         """
@@ -229,6 +377,23 @@ class WikiObject(BotObject):
             self._campbot.wiki.ui_url, self.url_path, self.document_id, lang
         )
 
+    def get_coordinates(self):
+        """
+        :return: (x, y) EPSG:3857 coordinates of document point, or None.
+        """
+
+        geometry = self.get("geometry")
+        geom = geometry["geom"] if geometry else None
+
+        if geom is None:
+            return None
+
+        # geometry is parsed only once, unless it has been modified
+        if self._coordinates is None or self._coordinates[0] != geom:
+            self._coordinates = (geom, utils.get_point(geom))
+
+        return self._coordinates[1]
+
     def get_title(self, lang):
         locale = self.get_locale(lang)
         return locale.get_title() if locale else ""
@@ -240,12 +405,21 @@ class WikiObject(BotObject):
         :return: String, or None if locale does not exists in this lang
         """
 
-        if "locales" not in self:
+        locales = self.locales
+
+        if locales is None:
             return None
 
-        for locale in self.locales:
-            if locale.lang == lang:
-                return locale
+        # index is built only once, unless locales have been modified
+        index = self._locale_index
+        if index is None or index[0] is not locales or index[1] != len(locales):
+            by_lang = {}
+            for locale in locales:
+                by_lang.setdefault(locale.lang, locale)
+
+            index = self._locale_index = (locales, len(locales), by_lang)
+
+        return index[2].get(lang)
 
     def search(self, patterns, lang):
         """
@@ -265,8 +439,24 @@ class WikiObject(BotObject):
                         return True
         return False
 
+    def get_changes(self):
+        """
+        Only modified keys are compared, in this document, its locales and
+        associations.
+
+        :return: (old, new), flattened modified fields, see differ.flatten()
+        """
+
+        old, new = {}, {}
+        _collect_changes(self, "root", old, new)
+        return old, new
+
+    def is_modified(self):
+        old, new = self.get_changes()
+        return old != new
+
     def print_diff(self):
-        report = get_diff_report(self._data, self)
+        report = get_flat_diff_report(*self.get_changes())
 
         for l in report:
             print(l)
@@ -311,6 +501,30 @@ class WikiObject(BotObject):
         return None
 
 
+def _collect_changes(bot_object, path, old, new):
+    modified_keys = bot_object.get_modified_keys()
+
+    for key in modified_keys:
+        original = bot_object._original.get(key, _missing)
+        if original is not _missing:
+            old.update(flatten(original, path + "." + key))
+        if key in bot_object:
+            new.update(flatten(dict.__getitem__(bot_object, key), path + "." + key))
+
+    # values of modified keys are already compared
+    for key, value in dict.items(bot_object):
+        if key in modified_keys:
+            pass
+
+        elif isinstance(value, BotObject):
+            _collect_changes(value, path + "." + key, old, new)
+
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, BotObject):
+                    _collect_changes(item, "{}.{}[{}]".format(path, key, i), old, new)
+
+
 class ShortWikiUser(BotObject):
     def get_contributions_url(self):
         return "{}/whatsnew#u={}".format(self._campbot.wiki.ui_url, self.user_id)
@@ -449,3 +663,82 @@ class Post(BotObject):
 class Poll(BotObject):
     def __init__(self, campbot, data):
         super(Poll, self).__init__(campbot, data)
+
+
+# short strings are often repeated values like activities or types
+_interned_string_max_length = 32
+
+
+class DocumentStore(object):
+    """
+    Compact storage of a large set of wiki documents. Dicts are stored as
+    tuples : the id of their keys, then their values. Short strings are
+    interned.
+
+    Documents are rebuilt on each access : they are copies, modifications
+    are not stored.
+    """
+
+    def __init__(self, campbot, documents=()):
+        self._campbot = campbot
+        self._key_ids = {}
+        self._keys = []
+        self._rows = []
+
+        for document in documents:
+            self.append(document)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        data = self.get_data(index)
+        return get_constructor(data["type"])(self._campbot, data)
+
+    def __iter__(self):
+        for index in range(len(self._rows)):
+            yield self[index]
+
+    def append(self, document):
+        """
+        :param document: wiki object, or raw data
+        """
+
+        self._rows.append(self._pack(document))
+
+    def get_data(self, index):
+        """
+        :return: document raw data, as a plain dict
+        """
+
+        return self._unpack(self._rows[index])
+
+    def _pack(self, value):
+        if isinstance(value, dict):
+            keys = tuple(value)
+            key_id = self._key_ids.get(keys)
+
+            if key_id is None:
+                key_id = self._key_ids[keys] = len(self._keys)
+                self._keys.append(keys)
+
+            # dict.values() : wiki objects could wrap their lazy fields
+            return (key_id,) + tuple(self._pack(item) for item in dict.values(value))
+
+        if isinstance(value, list):
+            return [self._pack(item) for item in value]
+
+        if isinstance(value, str) and len(value) <= _interned_string_max_length:
+            return sys.intern(value)
+
+        return value
+
+    def _unpack(self, value):
+        if isinstance(value, tuple):
+            keys = self._keys[value[0]]
+            return {key: self._unpack(item) for key, item in zip(keys, value[1:])}
+
+        if isinstance(value, list):
+            return [self._unpack(item) for item in value]
+
+        return value
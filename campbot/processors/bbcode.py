@@ -17,367 +17,536 @@ class ColorAndUnderlineRemover(MarkdownProcessor):
         )
 
 
+_PICTOS = {
+    "activity_1": ":skitouring:",
+    "activity_2": ":snow_ice_mixed:",
+    "activity_3": ":mountain_climbing:",
+    "activity_4": ":rock_climbing:",
+    "activity_5": ":ice_climbing:",
+    "activity_6": ":hiking:",
+    "activity_7": ":snowshoeing:",
+    "activity_8": ":paragliding:",
+    "picto_books": ":book:",
+    "picto_maps": ":map:",
+    "action_report": "",
+    "picto_summits": ":summit:",
+    "picto_huts": ":hut:",
+    "picto_products": ":local_product:",
+    "picto_parkings": ":parking:",
+    "picto_routes": ":motorway:",
+    "picto_users": ":mens:",
+}
+
+_IMG_PICTOS = {
+    "skitouring",
+    "snow_ice_mixed",
+    "mountain_climbing",
+    "rock_climbing",
+    "ice_climbing",
+    "hiking",
+    "snowshoeing",
+    "paragliding",
+}
+
+# One alternative per token kind. Only the outer named group of each
+# alternative is used to dispatch, see BBCodeRemover.convert(). The leading
+# group lists all first characters of tokens, and line starts, it lets the
+# engine skip plain text without trying every alternative.
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?:(?=[\[\n(<])|(?<=\n)|^)
+    (?:
+    (?P<header>(?:^|(?<=\n))(?P<hashes>\#+)(?-i:c)\ +)
+    |(?P<ltag>(?:^|(?<=\n))(?-i:L)\#~\ *\|+\ *)
+    |(?P<forum>\(\#(?-i:t)(?P<topic_id>\d+)\))
+    |(?P<anchor><span\ id="(?P<anchor_id>[\w-]+)"></span>)
+    |(?P<hr>\n?\[hr/?\]\n?)
+    |(?P<toc>\[toc\ ?\d?(?:\ right|\ left)?\])
+    |(?P<col>\[/?\ *col\ *\d*\ *(?:left|right)?\ *\d*\ *\])
+    |(?P<picto>\[picto\ (?P<picto_name>\w+)\ */\])
+    |(?P<img_picto>\[img=picto/(?P<img_picto_name>\w+)\.png\ /\])
+    |(?P<html>\[(?P<html_close>/?)(?P<html_name>sub|sup|s)\])
+    |(?P<center>\[(?P<center_close>/?)center\])
+    |(?P<em_text>
+        \[(?P<em_text_name>[bi])\]
+        (?P<em_text_body>[^\[\n\r*`]*)
+        \[/(?P=em_text_name)\]
+    )
+    |(?P<em>\[(?P<em_name>[bi])\])
+    |(?P<em_close>\[/(?P<em_close_name>[bi])\])
+    |(?P<url>\[\ *url\ *(?:=\ *(?P<url_arg>[^\]\n]*))?\])
+    |(?P<url_typo>(?:(?<=\n)|\[)url(?:=\ *(?P<url_typo_arg>[^\]\n]*))?\])
+    |(?P<url_http>\[url(?=http))
+    |(?P<url_close>\[[/\\]url\])
+    |(?P<email>\[email(?:=(?P<email_arg>[^\]\n]*))?\])
+    |(?P<email_close>\[/email\])
+    |(?P<acr>\[(?P<acr_name>acr|acronym)=(?P<acr_arg>[\w\ .-]+)\])
+    |(?P<acr_close>\[/(?P<acr_close_name>acr|acronym)\])
+    |(?P<block>
+        (?P<block_before>\n*)
+        \[(?P<block_name>importante?(?:\ col_50)?|imp|warning|warn)\]
+    )
+    |(?P<block_close>
+        \[/(?P<block_close_name>importante?|imp|warning|warn)\]
+        (?P<block_after>\n*)
+    )
+    )
+    """,
+    flags=re.IGNORECASE | re.VERBOSE,
+)
+
+# old tag names, still found in some documents
+_RENAMED_BLOCKS = {"imp": "important", "warn": "warning"}
+
+_BARE_URL_PATTERN = re.compile(r" *((?:http|www).*)$", flags=re.IGNORECASE)
+_BOLD_IN_ITALIC_PATTERN = re.compile(r"\*\*([^\n\r\*\`]*)\*\*")
+_ACR_CONTENT_PATTERN = re.compile(r"[\w \.]+")
+_NEWLINE_PATTERN = re.compile(r"\r?\n")
+
+# lines written by block and [hr] conversions
+_BLOCK_START_PATTERN = re.compile(r"!!!|----")
+
+
+class _Emphasis(object):
+    """
+    A successfully converted [b] or [i] tag. It's kept as an object until its
+    parent is rendered, because [center] and [url] move emphasis outside of
+    themselves.
+    """
+
+    def __init__(self, marker, text, before="", after=""):
+        self.marker = marker
+        self.text = text
+        self.before = before
+        self.after = after
+
+    def is_alone(self):
+        return not self.before and not self.after and "\n" not in self.text
+
+    def __str__(self):
+        return self.before + self.marker + self.text + self.marker + self.after
+
+
+class _Node(object):
+    """
+    An opened tag, waiting for its closing tag
+    """
+
+    def __init__(self, kind, name, match, line_start=False):
+        self.kind = kind
+        self.name = name
+        self.match = match
+        self.line_start = line_start
+        self.children = []
+
+    def get_text(self):
+        return "".join(map(str, self.children))
+
+    def get_single_emphasis(self):
+        """
+        :return: the emphasis if it's the only child (spaces aside), else None
+        """
+
+        result = None
+
+        for child in self.children:
+            if isinstance(child, _Emphasis) and result is None:
+                result = child
+            elif isinstance(child, _Emphasis) or child.strip(" "):
+                return None
+
+        return result if result and result.is_alone() else None
+
+    def get_opening(self):
+        """
+        :return: opening tag, as it must be written if the tag is never closed
+        """
+
+        if self.kind == "center":
+            return "<center>"
+
+        if self.kind.startswith("url"):
+            arg = self.match.group("url_arg") or self.match.group("url_typo_arg")
+            return "[url={}]".format(arg) if arg else "[url]"
+
+        if self.kind == "block":
+            name = self.match.group("block_name")
+            name = _RENAMED_BLOCKS.get(name.lower(), name)
+            return self.match.group("block_before") + "[" + name + "]"
+
+        return self.match.group(0)
+
+
 class BBCodeRemover(MarkdownProcessor):
     ready_for_production = True
     comment = "Replace BBcode by Markdown"
 
+    # kind of opening token -> kind of closing token
+    paired_tokens = {
+        "em": "em_close",
+        "url": "url_close",
+        "url_typo": "url_close",
+        "url_http": "url_close",
+        "email": "email_close",
+        "acr": "acr_close",
+        "block": "block_close",
+    }
+    closing_tokens = frozenset(paired_tokens.values())
+
     def init_modifiers(self):
-        def get_typo_cleaner(bbcode_tag, markdown_tag):
-            converters = [
-                Converter(pattern=r"\[ *url *\]", repl=r"[url]", flags=re.IGNORECASE),
-                Converter(pattern=r"\[ *url *= *", repl=r"[url=", flags=re.IGNORECASE),
-                Converter(
-                    pattern=r"\[" + bbcode_tag + r"\]\[/" + bbcode_tag + r"\]",
-                    repl=r"",
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\n *\[" + bbcode_tag + r"\] *",
-                    repl=r"\n[" + bbcode_tag + r"]",
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\[" + bbcode_tag + r"\] +",
-                    repl=r" [" + bbcode_tag + r"]",
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r" +\[/" + bbcode_tag + r"\]",
-                    repl=r"[/" + bbcode_tag + r"] ",
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\r\n\[/" + bbcode_tag + r"\]",
-                    repl=r"[/" + bbcode_tag + r"]\r\n",
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\[" + bbcode_tag + r"\] *\r\n([^\*\#]?)",
-                    repl=r"\r\n[" + bbcode_tag + r"]\1",
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\[center] *\["
-                    + bbcode_tag
-                    + r"\]([^\n\r\*\`]*?)\[/"
-                    + bbcode_tag
-                    + r"\] *\[/center\]",
-                    repl=markdown_tag + r"[center]\1[/center]" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\[url=(.*?)] *\["
-                    + bbcode_tag
-                    + r"\]([^\n\r\*\`]*?)\[/"
-                    + bbcode_tag
-                    + r"\] *\[/url\]",
-                    repl=markdown_tag + r"[url=\1]\2[/url]" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\["
-                    + bbcode_tag
-                    + r"\]([^\n\r\*\`]*?)\[/"
-                    + bbcode_tag
-                    + r"\]",
-                    repl=markdown_tag + r"\1" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\["
-                    + bbcode_tag
-                    + r"\]([^\n\r\*\`]+?)\r?\n([^\n\r\*\`]+?)\[/"
-                    + bbcode_tag
-                    + r"\]",
-                    repl=markdown_tag + r"\1\n\2" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\["
-                    + bbcode_tag
-                    + r"\]"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\[/"
-                    + bbcode_tag
-                    + r"\]",
-                    repl=markdown_tag + r"\1\n\2\n\3" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\["
-                    + bbcode_tag
-                    + r"\]"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\[/"
-                    + bbcode_tag
-                    + r"\]",
-                    repl=markdown_tag + r"\1\n\2\n\3" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\["
-                    + bbcode_tag
-                    + r"\]"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\[/"
-                    + bbcode_tag
-                    + r"\]",
-                    repl=markdown_tag + r"\1\n\2\n\3" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-                Converter(
-                    pattern=r"\["
-                    + bbcode_tag
-                    + r"\]"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\r?\n"
-                    + r"([^\n\r\*\`]+?)\[/"
-                    + bbcode_tag
-                    + r"\]",
-                    repl=markdown_tag + r"\1\n\2\n\3" + markdown_tag,
-                    flags=re.IGNORECASE,
-                ),
-            ]
-
-            def result(markdown):
-                for converter in converters:
-                    markdown = converter(markdown)
-
-                return markdown
-
-            return result
-
-        self.modifiers = [
-            get_typo_cleaner("b", "**"),
-            get_typo_cleaner("i", "*"),
-            Converter(
-                pattern=r"\[i\]\*\*([^\n\r\*\`]*?)\*\*\[/i\]",
-                repl=r"***\1***",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[(/?)imp\]", repl=r"[\1important]", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r"\[(/?)warn\]", repl=r"[\1warning]", flags=re.IGNORECASE
-            ),
-            Converter(pattern=r"(^|\n)(#+)c +", repl=r"\1\2 "),
-            Converter(pattern=r"\nurl=", repl=r"\n[url=", flags=re.IGNORECASE),
-            Converter(pattern=r"\nurl]", repl=r"\n[url]", flags=re.IGNORECASE),
-            Converter(pattern=r"\[ *url *= *\]", repl=r"[url]", flags=re.IGNORECASE),
-            Converter(pattern=r"\[ *url *= *", repl=r"[url=", flags=re.IGNORECASE),
-            Converter(pattern=r"\[\\url\]", repl=r"[/url]", flags=re.IGNORECASE),
-            Converter(pattern=r"\[urlhttp", repl=r"[url]http", flags=re.IGNORECASE),
-            Converter(
-                pattern=r"\[url=?\] *(http|www)(.*?)\[/url\]",
-                repl=r"\1\2 ",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[url\=(.*?)\]\[\/url\]", repl=r" \1 ", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r"\[url\=(.*?)\](.*?)\[\/url\]",
-                repl=r"[\2](\1)",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[email\](.*?)\[/email\]",
-                repl=r"[\1](mailto:\1)",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[email\=(.*?)\](.*?)\[\/email\]",
-                repl=r"[\2](mailto:\1)",
-                flags=re.IGNORECASE,
-            ),
-            Converter(pattern=r"(\n|^)L#\~ *\|+ *", repl=r"\1L#~ "),
-            Converter(
-                pattern=r"\(#t(\d+)\)",
-                repl=r"(https://www.camptocamp.org/forums/viewtopic.php?id=\1)",
-            ),
-            Converter(pattern=r"\[(/?)sub\]", repl=r"<\1sub>", flags=re.IGNORECASE),
-            Converter(pattern=r"\[(/?)sup\]", repl=r"<\1sup>", flags=re.IGNORECASE),
-            Converter(pattern=r"\[(/?)s\]", repl=r"<\1s>", flags=re.IGNORECASE),
-            Converter(
-                pattern=r"\[acr=([\w \.-]+)\]([\w \.]+)\[/acr\]",
-                repl=r'<abbr title="\1">\2</abbr>',
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[acronym=([\w \.-]+)\]([\w \.]+)\[/acronym\]",
-                repl=r'<abbr title="\1">\2</abbr>',
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[(/?)center]", repl=r"<\1center>", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r'<span id="([\w-]+)"></span>',
-                repl=r"{#\1}",
-                flags=re.IGNORECASE,
-            ),
-            Converter(pattern=r"\n?\[hr/?\]\n?", repl=r"\n----\n", flags=re.IGNORECASE),
-            Converter(
-                pattern=r"\[[tT]oc ?([\d])?( right| left)?\]",
-                repl=r"[toc]",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[/? *col *\d* *(left|right)? *\d* *\]",
-                repl=r"",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_1 */\]|\[img=picto/skitouring.png /\])",
-                repl=r":skitouring:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_6 */\]|\[img=picto/hiking.png /\])",
-                repl=r":hiking:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_2 */\]|\[img=picto/snow_ice_mixed.png /\])",
-                repl=r":snow_ice_mixed:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_3 */\]|\[img=picto/mountain_climbing.png /\])",
-                repl=r":mountain_climbing:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_4 */\]|\[img=picto/rock_climbing.png /\])",
-                repl=r":rock_climbing:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_5 */\]|\[img=picto/ice_climbing.png /\])",
-                repl=r":ice_climbing:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_7 */\]|\[img=picto/snowshoeing.png /\])",
-                repl=r":snowshoeing:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"(\[picto activity_8 */\]|\[img=picto/paragliding.png /\])",
-                repl=r":paragliding:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[picto picto_books */\]", repl=r":book:", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r"\[picto picto_maps */\]", repl=r":map:", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r"\[picto action_report */\]", repl=r"", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r"\[picto picto_summits */\]",
-                repl=r":summit:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[picto picto_huts */\]", repl=r":hut:", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r"\[picto picto_products */\]",
-                repl=r":local_product:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[picto picto_parkings */\]",
-                repl=r":parking:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[picto picto_routes */\]",
-                repl=r":motorway:",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\[picto picto_users */\]", repl=r":mens:", flags=re.IGNORECASE
-            ),
-            Converter(
-                pattern=r"\n*\[importante?(?: col_50)?\][ \n]*([^\n]+)[ \n]*\[/importante?\]\n*",
-                repl="\n\n!!! \\1\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[importante?(?: col_50)?\][ \n]*([^\n]+)\n+([^\n]+)[ \n]*\[/importante?\]\n*",
-                repl="\n\n!!! \\1\n!!! \\2\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[importante?(?: col_50)?\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/importante?\]\n*",
-                repl="\n\n!!! \\1\n!!! \\2\n!!! \\3\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[importante?(?: col_50)?\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/importante?\]\n*",
-                repl="\n\n!!! \\1\n!!! \\2\n!!! \\3\n!!! \\4\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[importante?(?: col_50)?\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/importante?\]\n*",
-                repl="\n\n!!! \\1\n!!! \\2\n!!! \\3\n!!! \\4\n!!! \\5\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[importante?(?: col_50)?\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/importante?\]\n*",
-                repl="\n\n!!! \\1\n!!! \\2\n!!! \\3\n!!! \\4\n!!! \\5\n!!! \\6\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[importante?(?: col_50)?\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/importante?\]\n*",
-                repl="\n\n!!! \\1\n!!! \\2\n!!! \\3\n!!! \\4\n!!! \\5\n!!! \\6\n!!! \\7\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[warning\][ \n]*([^\n]+)[ \n]*\[/warning\]\n*",
-                repl="\n\n!!!! \\1\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[warning\][ \n]*([^\n]+)\n+([^\n]+)[ \n]*\[/warning\]\n*",
-                repl="\n\n!!!! \\1\n!!!! \\2\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[warning\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/warning\]\n*",
-                repl="\n\n!!!! \\1\n!!!! \\2\n!!!! \\3\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[warning\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/warning\]\n*",
-                repl="\n\n!!!! \\1\n!!!! \\2\n!!!! \\3\n!!!! \\4\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[warning\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/warning\]\n*",
-                repl="\n\n!!!! \\1\n!!!! \\2\n!!!! \\3\n!!!! \\4\n!!!! \\5\n\n",
-                flags=re.IGNORECASE,
-            ),
-            Converter(
-                pattern=r"\n*\[warning\][ \n]*([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)\n+([^\n]+)[ \n]*\[/warning\]\n*",
-                repl="\n\n!!!! \\1\n!!!! \\2\n!!!! \\3\n!!!! \\4\n!!!! \\5\n!!!! \\6\n\n",
-                flags=re.IGNORECASE,
-            ),
-        ]
+        self.modifiers = [self.convert]
+
+    def convert(self, markdown):
+        """
+        Convert BBCode in one pass : the text is split in tokens, and tags are
+        paired using a stack. Unpaired tags are written as is.
+        """
+
+        stack = [_Node(None, None, None)]
+        position = 0
+        paired_tokens, closing_tokens = self.paired_tokens, self.closing_tokens
+
+        for match in _TOKEN_PATTERN.finditer(markdown):
+            start = match.start()
+            if start != position:
+                stack[-1].children.append(markdown[position:start])
+
+            position = match.end()
+            kind = match.lastgroup
+
+            if kind in paired_tokens or (
+                kind == "center" and not match.group("center_close")
+            ):
+                stack.append(self._open_node(kind, match, markdown, stack[-1]))
+
+            elif kind in closing_tokens or kind == "center":
+                self._close_node(kind, match, stack)
+
+            elif kind == "em_text":
+                stack[-1].children.append(
+                    self._convert_emphasis(match, markdown, stack[-1])
+                )
+
+            else:
+                stack[-1].children.append(self._convert_token(kind, match))
+
+        stack[-1].children.append(markdown[position:])
+
+        while len(stack) != 1:
+            self._flatten_node(stack)
+
+        return stack[0].get_text()
+
+    def _convert_token(self, kind, match):
+        """
+        Convert tokens that do not need to be paired
+        """
+
+        if kind == "header":
+            return match.group("hashes") + " "
+
+        if kind == "ltag":
+            return "L#~ "
+
+        if kind == "forum":
+            return "(https://www.camptocamp.org/forums/viewtopic.php?id={})".format(
+                match.group("topic_id")
+            )
+
+        if kind == "anchor":
+            return "{#" + match.group("anchor_id") + "}"
+
+        if kind == "hr":
+            return "\n----\n"
+
+        if kind == "toc":
+            return "[toc]"
+
+        if kind == "col":
+            return ""
+
+        if kind == "picto":
+            return _PICTOS.get(match.group("picto_name").lower(), match.group(0))
+
+        if kind == "img_picto":
+            name = match.group("img_picto_name").lower()
+            return ":" + name + ":" if name in _IMG_PICTOS else match.group(0)
+
+        if kind == "html":
+            return "<{}{}>".format(
+                match.group("html_close"), match.group("html_name").lower()
+            )
+
+        # tokens of an unknown kind are kept as they are
+        return match.group(0)
+
+    def _open_node(self, kind, match, markdown, parent):
+        if kind == "em":
+            name = match.group("em_name").lower()
+            line_start = self._is_line_start(match, markdown, parent)
+            return _Node(kind, name, match, line_start)
+
+        if kind == "acr":
+            name = match.group("acr_name").lower()
+        elif kind == "block":
+            name = "important" if match.group("block_name")[0] in "iI" else "warning"
+        else:
+            name = kind
+
+        return _Node(kind, name, match)
+
+    @staticmethod
+    def _is_line_start(match, markdown, parent):
+        """
+        :return: True if the tag begins a line. Spaces before it are removed.
+        """
+
+        start = match.start()
+        while start > 0 and markdown[start - 1] == " ":
+            start -= 1
+
+        line_start = start > 0 and markdown[start - 1] == "\n"
+        if line_start and parent.children and isinstance(parent.children[-1], str):
+            parent.children[-1] = parent.children[-1].rstrip(" ")
+
+        return line_start
+
+    def _convert_emphasis(self, match, markdown, parent):
+        """
+        Convert an emphasis holding only text, without line feed or marker :
+        it's the most frequent one, it needs no node.
+        """
+
+        line_start = self._is_line_start(match, markdown, parent)
+        before, text, after = self._move_spaces(
+            match.group("em_text_body"), line_start
+        )
+
+        if len(text) == 0:
+            return before + after
+
+        marker = "**" if match.group("em_text_name") in "bB" else "*"
+        return _Emphasis(marker, text, before, after)
+
+    def _close_node(self, kind, match, stack):
+        if kind == "em_close":
+            name = match.group("em_close_name").lower()
+        elif kind == "acr_close":
+            name = match.group("acr_close_name").lower()
+        elif kind == "block_close":
+            name = match.group("block_close_name")
+            name = "important" if name[0] in "iI" else "warning"
+        else:
+            name = None
+
+        for i in range(len(stack) - 1, 0, -1):
+            node = stack[i]
+            if self.paired_tokens.get(node.kind, node.kind) != kind:
+                continue
+
+            if name is not None and node.name != name:
+                continue
+
+            while len(stack) - 1 > i:
+                self._flatten_node(stack)
+
+            stack.pop()
+            stack[-1].children.append(self._render_node(node, match, stack[-1]))
+            return
+
+        stack[-1].children.append(self._get_unpaired_closing(kind, match))
+
+    @staticmethod
+    def _get_unpaired_closing(kind, match):
+        if kind == "center":
+            return "</center>"
+
+        if kind == "url_close":
+            return "[/url]"
+
+        if kind == "block_close":
+            name = match.group("block_close_name")
+            name = _RENAMED_BLOCKS.get(name.lower(), name)
+            return "[/" + name + "]" + match.group("block_after")
+
+        return match.group(0)
+
+    def _flatten_node(self, stack):
+        """
+        Write the top of the stack as an unpaired tag in its parent
+        """
+
+        node = stack.pop()
+        stack[-1].children.append(node.get_opening())
+        stack[-1].children += node.children
+
+    def _render_node(self, node, closing, parent):
+        if node.kind == "em":
+            return self._render_emphasis(node, closing)
+
+        text = node.get_text()
+
+        if node.kind == "center":
+            emphasis = node.get_single_emphasis()
+            if emphasis:
+                return _Emphasis(
+                    emphasis.marker, "<center>" + emphasis.text + "</center>"
+                )
+
+            return "<center>" + text + "</center>"
+
+        if node.kind == "block":
+            return self._render_block(node, closing, text, parent)
+
+        if "\n" not in text:
+            if node.kind.startswith("url"):
+                return self._render_url(node, text)
+
+            if node.kind == "email":
+                arg = node.match.group("email_arg")
+                return "[{}](mailto:{})".format(text, text if arg is None else arg)
+
+            if node.kind == "acr" and _ACR_CONTENT_PATTERN.fullmatch(text):
+                return '<abbr title="{}">{}</abbr>'.format(
+                    node.match.group("acr_arg"), text
+                )
+
+        return (
+            node.get_opening()
+            + text
+            + self._get_unpaired_closing(self.paired_tokens[node.kind], closing)
+        )
+
+    @staticmethod
+    def _move_spaces(text, line_start):
+        """
+        Split spaces and line feeds that must be moved outside of an emphasis
+
+        :return: (before, text, after)
+        """
+
+        if text[-1:] not in " \n" and text[:1] not in " \r\n":
+            return "", text, ""
+
+        before = ""
+        stripped = text.lstrip(" ")
+        if stripped != text and not line_start:
+            before = " "
+        text = stripped
+
+        newline = _NEWLINE_PATTERN.match(text)
+        if newline:
+            before += newline.group(0)
+            text = text[newline.end() :]
+
+        after = ""
+        if text.endswith("\n"):
+            after = "\r\n" if text.endswith("\r\n") else "\n"
+            text = text[: -len(after)]
+
+        stripped = text.rstrip(" ")
+        if stripped != text:
+            after = " " + after
+
+        return before, stripped, after
+
+    def _render_emphasis(self, node, closing):
+        marker = "**" if node.name == "b" else "*"
+        source = node.get_text()
+        before, text, after = self._move_spaces(source, node.line_start)
+
+        if len(text) == 0:
+            if "\n" in source:
+                return self._get_unchanged(node, closing)
+
+            return before + after
+
+        if node.name == "i":
+            bold = _BOLD_IN_ITALIC_PATTERN.fullmatch(text)
+            if bold:
+                return _Emphasis("***", bold.group(1), before, after)
+
+        # validity is checked on source, not on converted nested tags, except
+        # for nested emphasis using the same marker
+        if len(node.children) == 1 and isinstance(node.children[0], str):
+            raw = text  # no nested tag
+        else:
+            raw = closing.string[node.match.end() : closing.start()]
+            _, raw, _ = self._move_spaces(raw, node.line_start)
+
+        if (
+            marker in text
+            or "*" in raw
+            or "`" in raw
+            or ("\r" in raw or "\n" in raw or "\n" in text)
+            and not self._is_single_paragraph(raw, text)
+        ):
+            return self._get_unchanged(node, closing)
+
+        if "\r" in text:
+            text = _NEWLINE_PATTERN.sub("\n", text)
+
+        return _Emphasis(marker, text, before, after)
+
+    @staticmethod
+    def _get_unchanged(node, closing):
+        """
+        :return: emphasis tags that can't be converted, left as they are
+        """
+
+        return node.match.group(0) + node.get_text() + closing.group(0)
+
+    @staticmethod
+    def _is_single_paragraph(raw, text):
+        """
+        Multi-line emphasis is converted only if it holds no empty line, in
+        source and in converted text, and no converted block or [hr].
+        """
+
+        return all(
+            line and "\r" not in line for line in _NEWLINE_PATTERN.split(raw)
+        ) and all(
+            line and not _BLOCK_START_PATTERN.match(line)
+            for line in _NEWLINE_PATTERN.split(text)
+        )
+
+    def _render_url(self, node, text):
+        arg = node.match.group("url_arg") or node.match.group("url_typo_arg")
+
+        if not arg:
+            bare_url = _BARE_URL_PATTERN.match(text)
+            if bare_url:
+                return bare_url.group(1) + " "
+
+            return "[url]" + text + "[/url]"
+
+        if len(text) == 0:
+            return " " + arg + " "
+
+        emphasis = node.get_single_emphasis()
+        if emphasis:
+            return _Emphasis(emphasis.marker, "[{}]({})".format(emphasis.text, arg))
+
+        return "[{}]({})".format(text, arg)
+
+    def _render_block(self, node, closing, text, parent):
+        lines = [line for line in text.lstrip(" \n").split("\n") if line.strip(" ")]
+
+        if len(lines) == 0:
+            return (
+                node.get_opening()
+                + text
+                + self._get_unpaired_closing("block_close", closing)
+            )
+
+        prefix = "!!!! " if node.name == "warning" else "!!! "
+
+        # line feeds around blocks are replaced, even those written by
+        # a previous conversion
+        if parent.children and isinstance(parent.children[-1], str):
+            parent.children[-1] = parent.children[-1].rstrip("\n")
+
+        return "\n\n" + "\n".join(prefix + line for line in lines) + "\n\n"
 
 
 class InternalLinkCorrector(MarkdownProcessor):
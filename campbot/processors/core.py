@@ -1,4 +1,5 @@
 import re
+import time
 
 
 class Converter(object):
@@ -11,6 +12,32 @@ class Converter(object):
         return self.re.sub(repl=self.repl, string=text)
 
 
+class ProcessorStats(object):
+    """
+    Cumulative figures about one processor during a run
+    """
+
+    def __init__(self):
+        self.cpu_time = 0.0
+        self.scanned_fields = 0
+        self.changed_fields = 0
+        self.scanned_chars = 0
+
+    def get_average_text_size(self):
+        if self.scanned_fields == 0:
+            return 0
+
+        return self.scanned_chars / self.scanned_fields
+
+    def as_dict(self):
+        return {
+            "cpu_time": self.cpu_time,
+            "scanned_fields": self.scanned_fields,
+            "changed_fields": self.changed_fields,
+            "average_text_size": self.get_average_text_size(),
+        }
+
+
 class MarkdownProcessor(object):
     modifiers = []
     ready_for_production = False
@@ -18,6 +45,7 @@ class MarkdownProcessor(object):
     lang = None
 
     def __init__(self):
+        self.stats = ProcessorStats()
         self.init_modifiers()
 
     def init_modifiers(self):
@@ -25,7 +53,7 @@ class MarkdownProcessor(object):
 
     def __call__(self, wiki_object, langs):
         updated = False
-        for locale in wiki_object.get("locales", []):
+        for locale in wiki_object.locales or []:
             if self.lang is None or locale.lang == self.lang:
                 if langs is None or locale.lang in langs:
                     for field in locale.get_locale_fields():
@@ -35,8 +63,18 @@ class MarkdownProcessor(object):
                             and field not in ("title", "slope", "external_resources")
                         ):
                             markdown = locale[field]
+
+                            start = time.process_time()
                             new_value = self.modify(markdown)
-                            updated = updated or (new_value != markdown)
+                            self.stats.cpu_time += time.process_time() - start
+
+                            self.stats.scanned_fields += 1
+                            self.stats.scanned_chars += len(markdown)
+
+                            if new_value != markdown:
+                                self.stats.changed_fields += 1
+                                updated = True
+
                             locale[field] = new_value
 
         return updated
@@ -39,6 +39,14 @@ class LtagCleaner(MarkdownProcessor):
             flags=re.IGNORECASE,
         )
 
+        def clean_row(row):
+            if row.startswith(("L#", "R#")) and row[2:3] != "~":
+                row = leading_converter(row)
+                row = no_leading_converter(row)
+                row = multiple_converter(row)
+
+            return row
+
         def modifier(markdown):
             markdown = markdown.replace("\r\n", "\n")
             markdown = markdown.replace("\r", "\n")
@@ -46,40 +54,23 @@ class LtagCleaner(MarkdownProcessor):
             for converter in newline_converters:
                 markdown = converter(markdown)
 
-            lines = markdown.split("\n")
-            result = []
-
-            last_line_is_ltag = False
-            for line in lines:
-                if line.startswith("L#") or line.startswith("R#"):
-                    result.append(line)
-                    last_line_is_ltag = True
-
-                elif line.startswith("#") or line == "":
-                    result.append(line)
-                    last_line_is_ltag = False
-
-                elif not last_line_is_ltag:
-                    last_line_is_ltag = False
-                    result.append(line)
-
-                else:  # last_line_is_ltag is true here
-                    result[len(result) - 1] += "<br>" + line
+            # each row is a list of lines, that will be joined with <br>
+            rows = []
+            ltag_row = None
 
-            markdown = "\n".join(result)
+            for line in markdown.split("\n"):
+                if line.startswith(("L#", "R#")):
+                    ltag_row = [line]
+                    rows.append(ltag_row)
 
-            lines = markdown.split("\n")
-            result = []
+                elif ltag_row is not None and line and line[0] != "#":
+                    ltag_row.append(line)
 
-            for line in lines:
-                if (line.startswith("L#") or line.startswith("R#")) and line[2] != "~":
-                    line = leading_converter(line)
-                    line = no_leading_converter(line)
-                    line = multiple_converter(line)
+                else:
+                    ltag_row = None
+                    rows.append([line])
 
-                result.append(line)
-
-            return "\n".join(result)
+            return "\n".join(clean_row("<br>".join(row)) for row in rows)
 
         self.modifiers.append(modifier)
 
@@ -142,7 +133,6 @@ class LTagNumbering(object):
 
     # helper for final formatting
     FORMAT = "{type}#{text}".format
-    FORMAT_UNMATCHED = "{}".format
 
     def __init__(self):
 
@@ -160,9 +150,6 @@ class LTagNumbering(object):
         # are no more allowed anymore
         self.contains_label = False
 
-    def handle_unmatched(self, match):
-        return match.group(0)
-
     def compute(self, markdown, row_type, is_first_cell):
         """
         Replace all L# patterns by good numbering values. it tests that first
@@ -172,37 +159,39 @@ class LTagNumbering(object):
         assert markdown
 
         if not self.supported:
-            return self.PATTERN.sub(self.handle_unmatched, markdown)
+            return markdown
 
-        # this function does not belong to self, because it
-        # must access to row_type and is_first_cell
-        def handle_match(match):
+        # pattern is anchored at line start, so there is at most one match
+        match = self.PATTERN.match(markdown)
+        if match is None:
+            return markdown
 
-            assert match.group("local_ref") is None, "Not yet supported"
+        try:
+            result = self.handle_match(match, row_type, is_first_cell)
 
-            if match.group("header") is not None:  # means L#=
-                result = match.group(0)
+        except (NotImplementedError, AssertionError):
+            self.supported = False
+            return markdown
 
-            elif match.group("text_in_the_middle") is not None:
-                result = match.group(0)
+        return result + markdown[match.end() :]
 
-            elif match.group("multi_pitch") is not None:
-                result = self.handle_multipitch(match, is_first_cell)
+    def handle_match(self, match, row_type, is_first_cell):
+        assert match.group("local_ref") is None, "Not yet supported"
 
-            elif match.group("mono_pitch") is not None:
-                result = self.handle_monopitch(match, row_type, is_first_cell)
+        if match.group("header") is not None:  # means L#=
+            return match.group(0)
 
-            else:
-                raise NotImplementedError("Should not happen!?")
+        elif match.group("text_in_the_middle") is not None:
+            return match.group(0)
 
-            return result
+        elif match.group("multi_pitch") is not None:
+            return self.handle_multipitch(match, is_first_cell)
 
-        try:
-            return self.PATTERN.sub(handle_match, markdown)
+        elif match.group("mono_pitch") is not None:
+            return self.handle_monopitch(match, row_type, is_first_cell)
 
-        except (NotImplementedError, AssertionError):
-            self.supported = False
-            return self.PATTERN.sub(self.handle_unmatched, markdown)
+        else:
+            raise NotImplementedError("Should not happen!?")
 
     def compute_label(self, raw_label):
         """
@@ -324,13 +313,13 @@ class LtagMigrator(MarkdownProcessor):
 
         result = []
         for row in markdown.split("\n"):
-            if row.startswith("L#") or row.startswith("R#"):
-                row_type = row[0]
-                row = numbering.compute(row, row_type=row_type, is_first_cell=True)
+            if row.startswith(("L#", "R#")):
+                row = numbering.compute(row, row_type=row[0], is_first_cell=True)
 
-            result.append(row)
+                # as soon as numbering is not supported, document is kept as is
+                if not numbering.supported:
+                    return markdown
 
-        if not numbering.supported:
-            return markdown
+            result.append(row)
 
         return "\n".join(result)
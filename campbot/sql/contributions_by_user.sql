@@ -1,6 +1,6 @@
 Select * from (
 
-select count(1) as contribs, user_id, substr(written_at,0,5) as year
+select count(1) as contribs, user_id, strftime('%Y', written_at, 'unixepoch') as year
 from contribution
 where type!='i'
 group by user_id, year
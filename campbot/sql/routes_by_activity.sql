@@ -0,0 +1,5 @@
+SELECT activity.value AS activity, routes.quality, count(1) AS routes
+FROM routes
+JOIN document_activities AS activity ON activity.document_id=routes.document_id
+GROUP BY activity.value, routes.quality
+ORDER BY routes DESC
@@ -1,51 +1,118 @@
 import json
 from datetime import datetime
-from math import radians, degrees, sin, atan, sqrt, cos, atan2, pi, exp
+from math import sin, atan, sqrt, cos, atan2, pi, exp
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
 
 
 def today():
     return datetime.today()
 
 
-def compute_distance(object1, object2):
-    RADIUS = 6378137.0  # in meters on the equator
+RADIUS = 6378137.0  # in meters on the equator
+
+# under this size, pure python is faster than numpy
+_numpy_min_size = 32
+
+
+def get_point(geom):
+    """
+    :param geom: GeoJSON point, as a string
+
+    :return: (x, y) EPSG:3857 coordinates
+    """
+
+    geometry = json.loads(geom)
+    assert geometry["type"] == "Point"
+
+    return geometry["coordinates"][0], geometry["coordinates"][1]
+
+
+def get_coordinates(document):
+    """
+    :param document: wiki object, or dict with a geometry
+
+    :return: (x, y) EPSG:3857 coordinates of document point, or None
+    """
 
-    def mercator_to_gps(point):
-        x = point[0]
-        y = point[1]
+    if hasattr(type(document), "get_coordinates"):  # cached on wiki objects
+        return document.get_coordinates()
 
-        long = degrees(x / RADIUS)
-        lat = degrees(2 * (atan(exp(y / RADIUS)) - pi / 4))
+    if "geometry" not in document or document["geometry"]["geom"] is None:
+        return None
 
-        return lat, long
+    return get_point(document["geometry"]["geom"])
 
-    def distance(point1, point2):
 
-        if point1 is None or point2 is None:
-            return None
+def compute_distances(point, points):
+    """
+    Compute distances between one point and many others, in meters.
 
-        lat1 = radians(point1[0])
-        lon1 = radians(point1[1])
-        lat2 = radians(point2[0])
-        lon2 = radians(point2[1])
+    :param point: (x, y) EPSG:3857 coordinates
+    :param points: list of (x, y) EPSG:3857 coordinates, or None
 
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
+    :return: list of distances, None when a point is None
+    """
 
-        a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    if point is None:
+        return [None] * len(points)
 
-        return RADIUS * c
+    if numpy is not None and len(points) >= _numpy_min_size:
+        return _compute_distances_numpy(point, points)
 
-    def get_gps_coordinates(wiki_object):
-        if "geometry" not in wiki_object or wiki_object["geometry"]["geom"] is None:
-            return None
+    lon1 = point[0] / RADIUS
+    lat1 = 2 * atan(exp(point[1] / RADIUS)) - pi / 2
+    cos_lat1 = cos(lat1)
 
-        geometry = json.loads(wiki_object["geometry"]["geom"])
-        assert geometry["type"] == "Point"
+    result = []
 
-        # geometry["coordinates"] is EPSG:3785
+    for other in points:
+        if other is None:
+            result.append(None)
+            continue
 
-        return mercator_to_gps(geometry["coordinates"])
+        lon2 = other[0] / RADIUS
+        lat2 = 2 * atan(exp(other[1] / RADIUS)) - pi / 2
+
+        a = (
+            sin((lat2 - lat1) / 2) ** 2
+            + cos_lat1 * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+        )
+
+        result.append(RADIUS * 2 * atan2(sqrt(a), sqrt(1 - a)))
+
+    return result
+
+
+def _compute_distances_numpy(point, points):
+    missing = [other is None for other in points]
+    coordinates = numpy.array(
+        [point if other is None else other for other in points], dtype=float
+    )
+
+    lon1 = point[0] / RADIUS
+    lat1 = 2 * atan(exp(point[1] / RADIUS)) - pi / 2
+    lon2 = coordinates[:, 0] / RADIUS
+    lat2 = 2 * numpy.arctan(numpy.exp(coordinates[:, 1] / RADIUS)) - pi / 2
+
+    a = (
+        numpy.sin((lat2 - lat1) / 2) ** 2
+        + cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    )
+    distances = RADIUS * 2 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+
+    return [
+        None if is_missing else float(distance)
+        for is_missing, distance in zip(missing, distances)
+    ]
+
+
+def compute_distance(object1, object2):
+    """
+    :return: distance in meters between two documents points, or None
+    """
 
-    return distance(get_gps_coordinates(object1), get_gps_coordinates(object2))
+    return compute_distances(get_coordinates(object1), [get_coordinates(object2)])[0]
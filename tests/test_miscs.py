@@ -4,6 +4,7 @@ from __future__ import print_function, unicode_literals, division
 
 from tests.fixtures import fix_requests, fix_dump, ids_files, fix_input
 import os
+import json
 import pytest
 
 MESSAGE_URL = (
@@ -23,6 +24,17 @@ def test_distance(fix_requests):
     assert utils.compute_distance(item1, item2) is None
     assert 571.9 < utils.compute_distance(item1, item3) < 572
 
+    point = item1.get_coordinates()
+    assert item1.get_coordinates() is point  # cached
+
+    distances = utils.compute_distances(point, [None, item3.get_coordinates()] * 20)
+    assert distances[0] is None
+    assert 571.9 < distances[1] < 572
+    assert distances == [None, distances[1]] * 20
+
+    item1.geometry = {"geom": item3.geometry["geom"]}
+    assert utils.compute_distance(item1, item3) == 0
+
 
 def test_get_users_from_route(fix_requests):
     from campbot import CampBot
@@ -55,11 +67,22 @@ def test_main_entry_point(fix_requests, ids_files):
     main(get_main_args("export"))
     main(get_main_args("report_rc"))
     main(get_main_args("report", {"<url_or_file>": "routes#w=123"}))
+    main(get_main_args("report", {"<url_or_file>": "routes#w=123", "--processes": "2"}))
     main(get_main_args("clean_rc"))
     main(get_main_args("clean", {"<url_or_file>": "routes#w=123"}))
     main(get_main_args("clean", {"<url_or_file>": "waypoints#w=123"}))
     main(get_main_args("clean", {"<url_or_file>": ids_files}))
+    main(get_main_args("clean_rc", {"--stats": "stats.json"}))
+
+    with open("stats.json") as f:
+        stats = json.load(f)
+
+    assert len(stats) != 0
+    assert {"name", "comment", "cpu_time", "scanned_fields", "changed_fields"} <= set(
+        stats[0]
+    )
 
+    os.remove("stats.json")
     os.remove("outings.csv")
     os.remove("contributions.csv")
 
@@ -161,6 +184,171 @@ def test_wiki(fix_requests, fix_input):
     contrib.user.get_contributions_url()
 
 
+def test_lazy_wrapping(fix_requests):
+    from campbot import CampBot, objects
+
+    route = CampBot().wiki.get_route(293549)
+
+    raw_locale = dict.__getitem__(route, "locales")[0]
+    assert not isinstance(raw_locale, objects.Locale)
+    assert not isinstance(dict.__getitem__(route, "associations"), objects.BotObject)
+
+    # items give raw data, attributes wrap it
+    assert route["locales"][0] == raw_locale
+    assert not isinstance(route.get("locales")[0], objects.Locale)
+    assert isinstance(route.locales[0], objects.Locale)
+    assert route["locales"] is route.locales
+    assert isinstance(route.associations, objects.BotObject)
+    assert route.associations.images == []
+    assert not route.is_modified()
+
+    # wrapped locales are copies, original data is kept for diff
+    route.locales[0].description = "changed"
+    assert raw_locale["description"] != "changed"
+
+    # assigned values are not wrapped
+    route = CampBot().wiki.get_route(293549)
+    locale = objects.Locale(None, {"lang": "fr", "title": "title"})
+    route.locales = [locale]
+    route["associations"] = {"images": []}
+    assert route.locales[0] is locale
+    assert type(route.associations) is dict
+    assert set(route.get_modified_keys()) == {"locales", "associations"}
+
+
+def test_bot_object_attributes():
+    from campbot import objects
+
+    obj = objects.BotObject(None, {"type": "r", "_private": 1})
+
+    assert obj.type == "r"
+    obj.type = "w"
+    assert obj["type"] == "w"
+
+    assert not hasattr(obj, "missing")
+    assert not hasattr(obj, "_private")  # private names are never data
+
+    obj._private = 2
+    assert obj["_private"] == 1 and obj._private == 2
+
+
+def test_bot_object_fast_access(monkeypatch):
+    from campbot import objects
+
+    route = objects.Route(None, {"type": "r", "locales": [{"lang": "fr"}]})
+
+    # frequently used keys and items are never read by Python code
+    def fail(self, item):
+        raise AssertionError(item)
+
+    monkeypatch.setattr(objects.BotObject, "__getattr__", fail)
+    assert objects.WikiObject.__getitem__ is dict.__getitem__
+    assert route.type == "r" and route.locales[0].lang == "fr"
+
+    monkeypatch.undo()
+    assert not hasattr(route, "document_id")
+    route.document_id = 1
+    assert route["document_id"] == 1
+
+
+def test_changes(fix_requests, capsys):
+    import copy
+    import pickle
+    from campbot import CampBot, objects
+
+    route = CampBot().wiki.get_route(293549)
+    assert not route.is_modified()
+
+    locale = route.get_locale("fr")
+    locale.description = locale.description  # same value
+    route.quality = route.quality
+    assert not route.is_modified()
+
+    locale.description = "new description"
+    route.quality = "great"
+    del route["climbing_outdoor_type"]
+    assert route.is_modified()
+    assert locale.get_modified_keys() == ["description"]
+
+    old, new = route.get_changes()
+    assert set(old) == {
+        "root.locales[1].description",
+        "root.quality",
+        "root.climbing_outdoor_type",
+    }
+    assert new == {
+        "root.locales[1].description": "new description",
+        "root.quality": "great",
+    }
+
+    route.print_diff()
+    out = capsys.readouterr().out
+    assert "^^^ root.quality : medium >>> great" in out
+    assert "--- root.climbing_outdoor_type : 'multi'" in out
+
+    # modifications made in place are seen, and do not modify raw data
+    get_route = CampBot().wiki.get_route
+    for modify in (
+        lambda r: r.activities.append("skitouring"),
+        lambda r: r["geometry"].update(geom=None),
+        lambda r: r.associations["waypoints"].pop(),
+        lambda r: r.locales.pop(),
+        lambda r: r.locales[0].update(description="new description"),
+    ):
+        modified = get_route(293549)
+        assert not modified.is_modified()
+        modify(modified)
+        assert modified.is_modified()
+
+    fetched = get_route(293549)
+    assert fetched.activities == ["rock_climbing"] and fetched.geometry["geom"]
+    assert len(fetched.associations.waypoints) == 3 and len(fetched.locales) == 2
+    assert fetched.locales[0].description != "new description"
+
+    # copies keep original values, and share the bot
+    for clone in (copy.copy(route), copy.deepcopy(route)):
+        assert clone.get_changes() == (old, new)
+    clone = copy.deepcopy(route)
+    assert clone._campbot is route._campbot
+    assert clone.get_locale("fr") is clone.locales[1]
+    clone.get_locale("fr").description = "other description"
+    assert route.get_locale("fr").description == "new description"
+
+    # bots can't be pickled, documents without bot can
+    route = objects.Route(None, dict(CampBot().wiki.get_route(293549)))
+    assert not pickle.loads(pickle.dumps(route)).is_modified()
+    route.get_locale("fr").description = "new description"
+    route.quality = "great"
+    route = pickle.loads(pickle.dumps(route))
+    assert route.get_changes() == (
+        {
+            "root.locales[1].description": old["root.locales[1].description"],
+            "root.quality": "medium",
+        },
+        {
+            "root.locales[1].description": "new description",
+            "root.quality": "great",
+        },
+    )
+
+
+def test_get_locale(fix_requests):
+    from campbot import CampBot, objects
+
+    route = CampBot().wiki.get_route(293549)
+
+    assert route.get_locale("fr").lang == "fr"
+    assert route.get_locale("fr") is route.get_locale("fr")
+    assert route.get_locale("de") is None
+
+    # index follows locales modifications
+    route.locales.append(objects.Locale(None, {"lang": "de", "title": "x"}))
+    assert route.get_title("de") == "x"
+    route.locales = [objects.Locale(None, {"lang": "fr", "title": "y"})]
+    assert route.get_title("fr") == "y"
+    assert route.get_locale("es") is None
+
+
 def test_login(fix_requests):
     from campbot import CampBot
 
@@ -169,7 +357,7 @@ def test_login(fix_requests):
 
 def test_dump(fix_requests, fix_dump):
     from campbot.dump import Dump, get_document_types, _search
-    from campbot import CampBot
+    from campbot import CampBot, objects
 
     get_document_types()
 
@@ -178,20 +366,469 @@ def test_dump(fix_requests, fix_dump):
     class Contrib:
         document = route
 
-    dump = Dump()
+    dump = Dump(journal_mode="DELETE", synchronous="OFF")
+    dump.drop_indexes()
+    source = json.dumps(route, sort_keys=True)
     dump.insert(dump._conn.cursor(), route, 1687340, Contrib)
+    assert json.dumps(route, sort_keys=True) == source  # route is not modified
+    dump.create_indexes()
     dump._conn.commit()
+    assert dump._conn.execute("SELECT count(*) FROM locale").fetchone()[0] != 0
     dump.complete()
     dump.select(123)
     dump.search("r")
+
+    result = dump.search(r"refug(e|io) Llu", "fr")
+    assert {(r[2], r[3], r[4]) for r in result} == {
+        ("fr", "description", "Voie Cerdà Albert")
+    }
     dump.get_all_ids()
 
+    result = dump.nearest(191000, 5197000, 1000)
+    assert result == [(293549, "r", pytest.approx(465.10, abs=0.01), result[0][3])]
+    assert result[0][3] == route.get_coordinates()
+    assert dump.nearest(191000, 5197000, 500) == []
+    # route point is 628 units away, inside the square, like API bbox filter
+    assert [r[0] for r in dump.nearest(191000, 5197000, 600)] == [293549]
+    dump.spatial_index = False
+    assert dump.nearest(191000, 5197000, 600) == result
+    assert dump.nearest(191000, 5197000, 500) == []
+    dump.spatial_index = True
+    assert dump.nearest(191000, 5197000, 1000, document_type="w") == []
+
+    result = CampBot().find_closest_documents(
+        objects.Route, 191000, 5197000, 1000, dump=dump
+    )
+    assert len(result) == 1
+    assert result[0]["document"].document_id == 293549
+    assert result[0]["document"].get_title("fr") == route.get_title("fr")
+    assert result[0]["distance"] == pytest.approx(465.10, abs=0.01)
+
+    from campbot.dump import DumpWikiBot, _get_association, _insert_statements
+    from requests import HTTPError
+
+    # list values are kept as lists, even with one or no item, and booleans
+    # as booleans
+    waypoint = dict(
+        CampBot().wiki.get_waypoint(952999),
+        best_periods=["jun"],
+        langs=[],
+        blanket_unstaffed=True,
+        gas_unstaffed=False,
+    )
+    dump.insert(dump._conn.cursor(), waypoint, 1)
+    dump._conn.commit()
+    document = dump.get_document(952999)
+    assert document["best_periods"] == ["jun"] and document["langs"] == []
+    assert document["blanket_unstaffed"] is True
+    assert document["gas_unstaffed"] is False
+    assert document["elevation"] == waypoint["elevation"]
+
+    assert dump.get_associated_ids(952999, "wr") == [293549]
+    assert dump.get_associated_ids(293549, "rw") == [128898, 293915, 952999]
+    assert dump.get_associated_ids(293549, "ra") == [14267, 279930, 294791]
+    assert dump.get_associated_ids(952999, "ww") == []
+    assert dump.get_associated_ids(43055, "ww") == [952999]
+
+    # other associations between documents of the same type go both ways
+    dump._conn.executemany(
+        _insert_statements["association"],
+        [_get_association(10, "r", 5, "r"), _get_association(10, "r", 20, "r")],
+    )
+    assert dump.get_associated_ids(10, "rr") == [5, 20]
+    assert dump.get_associated_ids(5, "rr", "rr") == [5, 20]
+
+    dump.insert(dump._conn.cursor(), CampBot().wiki.get_outing(946946), 1)
+    dump._conn.commit()
+
+    assert dump.get_associated_ids(286726, "uo", "or") == [185930]
+    assert dump.get_users_from_route(185930) == [286726]
+    assert CampBot().get_users_from_route(185930, dump=dump) == [
+        {"document_id": 286726, "type": "u"}
+    ]
+
+    bot = CampBot()
+    bot.wiki = DumpWikiBot(bot, bot.wiki.api_url, dump)
+
+    doc = bot.wiki.get_route(293549)
+    assert doc.get_title("fr") == route.get_title("fr")
+    assert doc.get_locale("fr").description == route.get_locale("fr").description
+    assert doc.get_locale("fr").route_history is None
+    for key in ("activities", "durations", "route_types", "main_waypoint_id"):
+        assert doc[key] == route[key]
+    assert doc.protected is False and doc.elevation_max is None
+    assert doc.geometry["geom"] == route.geometry["geom"]
+    # only associated documents present in the dump are known
+    assert doc.associations.waypoints == [{"document_id": 952999, "type": "w"}]
+    assert doc.associations.routes == [] and doc.areas == []
+
+    with pytest.raises(HTTPError):
+        bot.wiki.get_route(1)
+
+    assert [
+        d.document_id for d in bot.wiki.get_documents({"act": "rock_climbing"}, "r")
+    ] == [293549]
+    assert list(bot.wiki.get_documents({"act": "skitouring"}, "r")) == []
+    assert [d.document_id for d in bot.wiki.get_documents({"w": "952999"}, "r")] == [
+        293549
+    ]
+    assert list(bot.wiki.get_documents({"w": "1"}, "r")) == []
+    assert list(bot.wiki.get_documents({"bbox": "0%2C0%2C1%2C1"}, "r")) == []
+    with pytest.raises(NotImplementedError):
+        list(bot.wiki.get_documents({"rock_type": "calcaire"}, "r"))
+
+    contribs = list(bot.wiki.get_contributions(oldest_date="2017-12-20"))
+    assert len(contribs) != 0
+    assert contribs[0].lang == "fr"
+
+    # saves are merged in the live document
+    doc.get_locale("fr").description = "new description"
+    live_doc = bot.wiki._get_live_document("/routes/293549", doc)
+    assert live_doc["locales"][1]["lang"] == "fr"
+    assert live_doc["locales"][1]["description"] == "new description"
+    assert live_doc["locales"][1]["version"] == route.get_locale("fr").version
+    # and so are other modifications, data missing from the dump is kept
+    doc.elevation_max = 1000
+    doc.associations.waypoints.pop()
+    doc.locales.append(objects.Locale(bot, {"lang": "it", "title": "via"}))
+    live_doc = bot.wiki._get_live_document("/routes/293549", doc)
+    assert live_doc["elevation_max"] == 1000
+    assert [w["document_id"] for w in live_doc["associations"]["waypoints"]] == [
+        128898,
+        293915,
+    ]
+    assert [locale["lang"] for locale in live_doc["locales"]] == ["es", "fr", "it"]
+    assert live_doc["locales"][1]["description"] == "new description"
+    assert live_doc["associations"]["routes"] == route.associations.routes
+    doc.save("test", ask_before_saving=False)
+
+    doc.version = 2
+    with pytest.raises(Exception):
+        doc.save("test", ask_before_saving=False)
+
+    # live document is the shared fixture data, it's left unchanged
+    assert CampBot().wiki.get_route(293549) == route
+
+    from campbot.__main__ import main
+    import gc
+
+    main(get_main_args("report", {"<url_or_file>": "routes", "--dump": "test.db"}))
+    gc.collect()  # closes CLI dump connection
+
     _search("r")
+    os.remove("ids.txt")
+
+    dump.close()
+    os.remove("test.db")
+
+
+def test_dump_complete(fix_requests, fix_dump):
+    from campbot.dump import Dump
+    from campbot import CampBot, objects
+
+    dump = Dump(journal_mode="DELETE")
+    dump.insert(dump._conn.cursor(), CampBot().wiki.get_route(293549), 1738923)
+    dump._conn.commit()
+
+    # route is in the feed with an older version, it must not be downloaded
+    dump.get_highest_version_id = lambda table="document": 1738000
+    get_full_document = objects.Contribution.get_full_document
+    objects.Contribution.get_full_document = None
+    try:
+        dump.complete()
+    finally:
+        objects.Contribution.get_full_document = get_full_document
+
+    assert dump.get_version_ids([293549, 1]) == {293549: 1738923}
+
+    dump.close()
+    os.remove("test.db")
+
+
+def test_dump_contribution_migration(fix_requests, fix_dump):
+    from campbot.dump import Dump
+    from campbot import CampBot
+    import sqlite3
+    conn = sqlite3.connect("test.db")
+    conn.execute(
+        "CREATE TABLE contribution (version_id INTEGER PRIMARY KEY DESC,"
+        " document_id INTEGER, user_id INTEGER, type CHAR(1), written_at CHAR(32)"
+        ") WITHOUT ROWID;"
+    )
+    conn.executemany(
+        "INSERT INTO contribution VALUES (?,?,?,?,?)",
+        [
+            (1, 10, 100, "r", "2017-12-20T21:49:41.363647+00:00"),
+            (2, 10, 100, "r", "2017-12-21T21:49:41.363647+00:00"),
+            (3, 11, 100, "w", "2017-12-21T21:49:41.363647+00:00"),
+            (4, 12, 101, "i", "2017-12-21T21:49:41.363647+00:00"),
+            (5, 12, 102, "r", "2019-12-21T21:49:41+01:00"),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    dump = Dump(journal_mode="DELETE")
+    assert list(dump.get_contributions(user_id=100, oldest_date=1513814400)) == [
+        (3, 11, "w", 100, 1513892981, None),
+        (2, 10, "r", 100, 1513892981, None),
+    ]
+    assert dump.get_contributor_counts() == [(100, 2), (102, 1)]
+    assert dump.get_contributor_counts(newest_date=1546300800) == [(100, 2)]
+
+    sql_dir = os.path.join(os.path.dirname(__file__), "../campbot/sql")
+    sql_file = os.path.join(sql_dir, "contrib_count.sql")
+    assert dump.sql_file(sql_file).fetchall() == [(100, 2)]
+    sql_file = os.path.join(sql_dir, "contributions_by_user.sql")
+    assert dump.sql_file(sql_file).fetchall() == [(3, 100, "2017")]
+
+    CampBot().get_new_contributors(dump=dump)
+
+    dump.close()
+    os.remove("test.db")
+
 
-    del dump
+def test_dump_typed_schema(fix_requests, fix_dump):
+    from campbot.dump import Dump
+    from campbot import CampBot
+
+    route = CampBot().wiki.get_route(293549)
+
+    dump = Dump(journal_mode="DELETE")
+    dump.insert(dump._conn.cursor(), route, 1)
+    dump._conn.execute("DROP TABLE association")
+    dump._conn.commit()
+    dump.close()
+
+    # typed tables are filled from existing documents
+    dump = Dump(journal_mode="DELETE", typed_schema=True)
+    assert dump._conn.execute(
+        "SELECT document_id, quality, main_waypoint_id, climbing_outdoor_type "
+        "FROM routes"
+    ).fetchall() == [(293549, "medium", 952999, "multi")]
+    # associations are rebuilt from document properties, with known documents
+    assert dump.get_associated_ids(952999, "wr") == []
+
+    dump.insert(dump._conn.cursor(), route, 2)
+    dump._conn.commit()
+
+    sql_file = os.path.join(
+        os.path.dirname(__file__), "../campbot/sql/routes_by_activity.sql"
+    )
+    assert dump.sql_file(sql_file).fetchall() == [("rock_climbing", "medium", 1)]
+    assert dump.get_associated_ids(952999, "wr") == [293549]
+
+    dump.delete(293549)
+    assert dump._conn.execute(
+        "SELECT count(*) FROM document_activities"
+    ).fetchone() == (0,)
+    dump.close()
+
+    # existing typed tables are filled, even without typed_schema
+    dump = Dump(journal_mode="DELETE")
+    assert dump.typed_schema
+    dump.insert(dump._conn.cursor(), route, 3)
+    dump._conn.commit()
+    assert dump.sql_file(sql_file).fetchall() == [("rock_climbing", "medium", 1)]
+
+    dump.close()
     os.remove("test.db")
 
 
+def test_dump_strings(fix_dump):
+    from campbot.dump import Dump
+
+    dump = Dump(journal_mode="DELETE", string_cache_size=2)
+    ids = [dump.get_string_id(string) for string in "abcab"]
+    assert len(set(ids[:3])) == 3 and ids[3:] == ids[:2]
+    assert len(dump._string_ids) == 2
+    assert dump.get_string_id("d", create=False) is None
+    dump._conn.commit()
+    dump.close()
+
+    dump = Dump(journal_mode="DELETE")
+    assert len(dump._string_ids) == 0  # nothing is loaded at startup
+    assert dump.get_string_id("c", create=False) == ids[2]
+    dump.close()
+    os.remove("test.db")
+
+
+def test_dump_compression(fix_requests, fix_dump):
+    from campbot.dump import Dump
+    from campbot import CampBot
+
+    route = CampBot().wiki.get_route(293549)
+
+    dump = Dump(journal_mode="DELETE")
+    dump.insert(dump._conn.cursor(), route, 1)
+    dump._conn.commit()
+    expected = dump.get_document(293549)
+    dump.close()
+
+    dump = Dump(journal_mode="DELETE", compress_threshold=500)
+    dump.train_dictionary()
+    dump.compress_locales()
+
+    assert dump._conn.execute(
+        "SELECT count(*) FROM locale WHERE typeof(value)='blob'"
+    ).fetchone() == (4,)
+    assert dump.get_document(293549) == expected
+    assert len(dump.search(r"\[b\]refugio\[/b\]")) == 1
+
+    # new values are compressed, and still indexed
+    dump.insert(dump._conn.cursor(), route, 2)
+    dump._conn.commit()
+    assert dump.get_document(293549) == expected
+    assert len(dump.search(r"\[b\]refugio\[/b\]")) == 1
+
+    dump.delete(293549)
+    assert dump.search(r"\[b\]refugio\[/b\]") == []
+    assert dump._conn.execute(
+        "SELECT count(*) FROM locale_fts WHERE locale_fts MATCH 'refugio'"
+    ).fetchone() == (0,)
+    dump.close()
+
+    # other SQLite clients can write locales
+    import sqlite3
+    conn = sqlite3.connect("test.db")
+    conn.execute("INSERT INTO locale VALUES (1, 'fr', 1, 'refugio')")
+    conn.execute("DELETE FROM locale")
+    conn.commit()
+    conn.close()
+    os.remove("test.db")
+
+
+def test_dump_snapshot(fix_requests, fix_dump):
+    import sqlite3
+    from campbot.dump import Dump
+    from campbot import CampBot
+
+    route = CampBot().wiki.get_route(293549)
+
+    dump = Dump(journal_mode="DELETE")
+    dump.insert(dump._conn.cursor(), route, 1)
+    dump.publish_snapshot("snapshot.db")
+
+    reader = Dump("snapshot.db", snapshot=True)
+    assert reader.get_document(293549) == dump.get_document(293549)
+    assert len(reader.search(r"\[b\]refugio\[/b\]")) == 1
+    with pytest.raises(sqlite3.OperationalError):
+        reader.delete(293549)
+
+    # readers of the previous snapshot are not disturbed by a new one
+    dump.delete(293549)
+    dump.publish_snapshot("snapshot.db")
+    assert reader.get_document(293549) is not None
+    reader.close()
+
+    reader = Dump("snapshot.db", snapshot=True)
+    assert reader.get_document(293549) is None
+    reader.close()
+
+    dump.close()
+    os.remove("test.db")
+    os.remove("snapshot.db")
+
+    # python < 3.7 has no backup(), files are copied, with the WAL file
+    dump = Dump()
+    dump.insert(dump._conn.cursor(), route, 1)
+    dump._conn.commit()
+    dump._copy_database("copy.db")
+    copy = Dump("copy.db")
+    assert copy.get_document(293549) == dump.get_document(293549)
+    copy.close()
+    dump.close()
+    os.remove("test.db")
+    os.remove("copy.db")
+
+
+def test_document_store(fix_requests):
+    from campbot import CampBot, objects
+
+    bot = CampBot()
+    route = bot.wiki.get_route(293549)
+    waypoint = bot.wiki.get_waypoint(952999)
+
+    store = objects.DocumentStore(bot, [route, dict(waypoint)])
+    assert len(store) == 2
+    assert store.get_data(0) == route
+    assert store.get_data(1) == waypoint
+
+    documents = list(store)
+    assert isinstance(documents[0], objects.Route)
+    assert isinstance(documents[1], objects.Waypoint)
+    assert documents[0].get_title("fr") == route.get_title("fr")
+
+    # documents are copies
+    documents[0].locales[0].title = "changed"
+    assert store[0].locales[0].title == route.locales[0].title
+
+
+def test_report_processes(fix_requests, capsys):
+    from campbot import CampBot
+
+    bot = CampBot()
+    bot.report("routes#w=123", "fr")
+    expected = capsys.readouterr().out
+    assert expected.strip() != ""
+
+    bot.report("routes#w=123", "fr", processes=2)
+    assert capsys.readouterr().out == expected
+
+    # more shards than shards in flight
+    from campbot import objects
+    from campbot.checkers import get_document_tests
+    from campbot.core import _test_documents, _test_documents_in_processes
+
+    route = bot.wiki.get_route(293549)
+    route.get_locale("fr").description = ""
+    documents = [route, bot.wiki.get_waypoint(952999)] * 5
+    store = objects.DocumentStore(bot, documents)
+    expected = _test_documents("fr", documents, get_document_tests("fr"))
+    assert any(expected)
+    assert _test_documents_in_processes(store, "fr", 1) == expected
+
+
+def test_dump_full_text_query():
+    from campbot.dump import get_full_text_query
+
+    assert get_full_text_query(r"\[picto") == '"[picto"'
+    assert get_full_text_query(r"foo(bar)?b\w*z") == '"foob"'
+    assert get_full_text_query(r"(abc)+ d\"ef|x") is None
+    assert get_full_text_query(r"(abc)+ d\"ef") == '("abc" AND "abc d""ef")'
+    assert get_full_text_query(r"\b\d+ h( \d+)?\b") is None
+    assert get_full_text_query(r"\[/?b\]") == '("[/b]" OR "[b]")'
+    assert get_full_text_query(r"(\n|^)L#\~ *\|") == '"L#~"'
+    assert (
+        get_full_text_query(r"(col|lac) \d+ (redescendre|remonter)")
+        == '(("col " OR "lac ") AND (" redescendre" OR " remonter"))'
+    )
+
+
+def test_dump_bbox():
+    from campbot.dump import get_bbox
+
+    assert get_bbox(None, None) is None
+    assert get_bbox('{"type": "Point", "coordinates": [1, 2]}', None) == (1, 1, 2, 2)
+    assert get_bbox(
+        None, '{"type": "Polygon", "coordinates": [[[1, 2], [3, -4], [0, 5]]]}'
+    ) == (0, 3, -4, 5)
+
+
+def test_dump_prefetch():
+    from campbot.dump import _prefetch
+    import time
+
+    def fetch(i):
+        time.sleep(0.001 * (i % 3))
+        return i * 2
+
+    result = [
+        (item, future.result()) for item, future in _prefetch(range(20), fetch, 4)
+    ]
+    assert result == [(i, i * 2) for i in range(20)]
+
+
 def test_misc():
     from campbot import core, utils
     from campbot.__main__ import main_entry_point
@@ -233,6 +870,9 @@ def get_main_args(action, others=None):
         "--ends": "2999-12-31",
         "--starts": "2017-06-01",
         "--out": "",
+        "--stats": None,
+        "--dump": None,
+        "--processes": None,
     }
 
     if others:
@@ -329,6 +969,7 @@ def test_weird(fix_requests, fix_input):
         f.write("123|1\n")
 
     bot.get_new_contributors()
+    os.remove("contributors.txt")
 
 
 def test_get_closest_documents(fix_requests):
@@ -336,7 +977,25 @@ def test_get_closest_documents(fix_requests):
 
     bot = CampBot()
 
-    bot.find_closest_documents(objects.Waypoint, 289284, 6175526, 2000)
+    result = bot.find_closest_documents(objects.Waypoint, 289284, 6175526, 2000)
+    assert len(result) == 30
+
+    distances = [item["distance"] for item in result]
+    assert distances == sorted(distances)
+
+    downloads = []
+
+    def get_wiki_object(item_id, constructor):
+        downloads.append(item_id)
+        return constructor(bot, {"document_id": item_id})
+
+    bot.wiki.get_wiki_object = get_wiki_object
+
+    result = bot.find_closest_documents(
+        objects.Waypoint, 289284, 6175526, 2000, limit=3
+    )
+    assert [item["distance"] for item in result] == distances[:3]
+    assert downloads == [item["document"].document_id for item in result]
 
 
 def test_get_voters(fix_requests):
@@ -44,6 +44,7 @@ def test_ltag_cleaner():
             "L#{} || [[touche/pas|au lien]] : stp::merci ",
             "L#{} | [[touche/pas|au lien]] : stp|merci ",
         ),
+        ("L#{}\n1\n2\n3\n#Titre", "L#{}<br>1<br>2<br>3\n#Titre"),
     ]
 
     numbering_postfixs = [
@@ -87,6 +88,8 @@ def test_ltag_migrator():
         ("L#\nL#+2\nL#\nL#6\nL#+2\nL#+\nL#", "L#1\nL#3\nL#4\nL#6\nL#8\nL#9\nL#10"),
         ("L#\nL#+1-+1\nL#-+1", "L#1\nL#2-3\nL#4-5"),
         ("L#-+7 | 5c\nL#", "L#1-8 | 5c\nL#9"),
+        ("L# | L#\nR# | R#\nL#+2 | L#", "L#1 | L#\nR#1 | R#\nL#3 | L#"),
+        ("L#\nL#!\nL#", "L#\nL#!\nL#"),
     ]
 
     p = LtagMigrator().modify
@@ -94,9 +97,15 @@ def test_ltag_migrator():
     for markdown, expected in tests:
         assert p(markdown) == expected
 
+    # long multi-pitch routes
+    markdown = "\n".join("L# | 5c\ntext" for _ in range(1000))
+    expected = "\n".join("L#{} | 5c\ntext".format(i) for i in range(1, 1001))
+    assert p(markdown) == expected
+
 
 def test_bbcode_remover():
     from campbot.processors import BBCodeRemover
+    import time
 
     tests = [
         {
@@ -220,12 +229,58 @@ def test_bbcode_remover():
         {"source": "[sub]xx[/sub]", "expected": "<sub>xx</sub>",},
         {"source": "[sup]xx[/sup]", "expected": "<sup>xx</sup>",},
         {"source": "[s]xx[/s]", "expected": "<s>xx</s>",},
+        {"source": "[b]1\n2\n3\n4[/b]", "expected": "**1\n2\n3\n4**"},
+        {"source": "[b]1\n\n2[/b]", "expected": "[b]1\n\n2[/b]"},
+        {"source": "[i]**x**[/i]", "expected": "***x***"},
+        {"source": "[b]x[/i]", "expected": "[b]x[/i]"},
+        {
+            "source": "a\n[imp] l1\nl2 [/imp]\n\n[warning]l3[/warning]b",
+            "expected": "a\n\n!!! l1\n!!! l2 \n\n!!!! l3\n\nb",
+        },
+        {
+            "source": "[picto activity_1 /] [img=picto/hiking.png /]",
+            "expected": ":skitouring: :hiking:",
+        },
+        # unconverted emphasis is left as it is
+        {"source": "[i])\n\n[/i]", "expected": "[i])\n\n[/i]"},
+        {"source": "[b]\n[/b]", "expected": "[b]\n[/b]"},
+        # empty emphasis is removed, spaces are kept
+        {"source": "a [b] [/b]x", "expected": "a  x"},
+        # nested emphasis is converted from the innermost one
+        {"source": "[b]a[b]b[/b] c[/b]", "expected": "[b]a**b** c[/b]"},
+        {"source": "[b]a[i]b[/i]c[/b]", "expected": "**a*b*c**"},
+        # blocks with only spaces are not converted
+        {"source": "[imp] [/imp]", "expected": "[important] [/important]"},
+        # each block is paired with its own closing tag
+        {
+            "source": "[imp]a[/imp] x [imp]b[/imp]",
+            "expected": "\n\n!!! a\n\n x \n\n!!! b\n\n",
+        },
+        {
+            "source": "[imp]a[/imp]\n[warning]b[/warning]",
+            "expected": "\n\n!!! a\n\n!!!! b\n\n",
+        },
+        # converted blocks can't be emphasized
+        {
+            "source": "[i][warning]a[/warning][imp]b[/imp][/i]",
+            "expected": "[i]\n\n!!!! a\n\n!!! b\n\n[/i]",
+        },
+        {"source": "x [b]a[hr]b[/b]", "expected": "x [b]a\n----\nb[/b]"},
+        {"source": "[i]a\nb[/i]", "expected": "*a\nb*"},
     ]
 
     p = BBCodeRemover().modify
     for test in tests:
         assert p(test["source"]) == test["expected"]
 
+    # long texts full of tags
+    markdown = "[b]bold[/b] and [i] it [/i] [url=http://a.fr]link[/url]\n" * 20000
+    expected = "**bold** and  *it* [link](http://a.fr)\n" * 20000
+
+    start = time.process_time()
+    assert p(markdown) == expected
+    assert time.process_time() - start < 2
+
 
 def test_col_u_remover():
     from campbot.processors import ColorAndUnderlineRemover
@@ -397,6 +452,30 @@ def test_all_replacements(fix_requests):
     ), "external_resources field must no be corrected"
 
 
+def test_processor_stats():
+    from campbot.objects import Route
+    from campbot.processors import MarkdownCleaner
+
+    processor = MarkdownCleaner()
+    route = Route(
+        None,
+        {
+            "locales": [
+                {"lang": "fr", "description": "\n\nx", "summary": "y"},
+                {"lang": "de", "description": "z"},
+            ]
+        },
+    )
+
+    assert processor(route, ["fr"])
+
+    stats = processor.stats.as_dict()
+    assert stats["scanned_fields"] == 2
+    assert stats["changed_fields"] == 1
+    assert stats["average_text_size"] == 2
+    assert stats["cpu_time"] >= 0
+
+
 def test_diacritics_replacements():
     from campbot.processors.cleaners import DiacriticsFix
 